@@ -1,197 +1,15 @@
 # api/ai-assistant.py - Unified AI endpoint (для бота И для приложения)
 from http.server import BaseHTTPRequestHandler
-import json
-import os
-from datetime import datetime, timedelta
-import requests
+from urllib.parse import urlparse, parse_qs
 
+from api.assistant import get_chat_history
 from api.auth import require_user_id
-from api.db import get_supabase_for_user
-from api.utils import read_json, send_ok, send_error
-from api.logger import log_event
+from api.services import ask_assistant
+from api.utils import list_payload, read_json, send_ok, send_error
 
-
-def get_chat_history(user_id: int, limit: int = 10) -> list:
-    """Получает историю чата из БД"""
-    supabase = get_supabase_for_user(user_id)
-    
-    try:
-        result = supabase.table("ai_chat_history") \
-            .select("*") \
-            .eq("user_id", user_id) \
-            .order("created_at", desc=True) \
-            .limit(limit) \
-            .execute()
-        
-        return list(reversed(result.data)) if result.data else []
-    except:
-        return []
-
-
-def save_chat_message(user_id: int, role: str, content: str):
-    """Сохраняет сообщение в БД"""
-    supabase = get_supabase_for_user(user_id)
-    
-    try:
-        supabase.table("ai_chat_history").insert({
-            "user_id": user_id,
-            "role": role,
-            "content": content,
-            "created_at": datetime.now().isoformat()
-        }).execute()
-    except Exception as e:
-        print(f"Save chat error: {e}")
-
-
-def get_financial_context(user_id: int) -> dict:
-    """Собирает финансовый контекст"""
-    supabase = get_supabase_for_user(user_id)
-    date_from = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-    
-    try:
-        # Транзакции
-        result = supabase.table("expenses").select("*").gte("created_at", date_from).execute()
-        transactions = result.data
-        
-        # Подписки
-        subs_result = supabase.table("subscriptions").select("*").execute()
-        subscriptions = subs_result.data
-        
-        # Статистика
-        total_income = sum(float(t['amount']) for t in transactions if t['type'] == 'income')
-        total_expense = sum(float(t['amount']) for t in transactions if t['type'] == 'expense')
-        
-        categories = {}
-        for t in transactions:
-            if t['type'] == 'expense':
-                cat = t.get('category', 'Разное')
-                categories[cat] = categories.get(cat, 0) + float(t['amount'])
-        
-        top_categories = sorted(categories.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        return {
-            "balance": total_income - total_expense,
-            "total_income": total_income,
-            "total_expense": total_expense,
-            "daily_average": round(total_expense / 30, 2) if total_expense > 0 else 0,
-            "top_categories": [{"category": c, "amount": a} for c, a in top_categories],
-            "subscriptions": [{"name": s['name'], "amount": s['amount']} for s in subscriptions],
-            "transactions_count": len(transactions)
-        }
-    except Exception as e:
-        print(f"Context error: {e}")
-        return {}
-
-
-def create_system_prompt(context: dict) -> str:
-    """Создаёт системный промпт"""
-    
-    top_cats = "\n".join([f"  - {c['category']}: {c['amount']:.2f} ₽" for c in context.get('top_categories', [])])
-    subs = "\n".join([f"  - {s['name']}: {s['amount']} ₽" for s in context.get('subscriptions', [])])
-    
-    return f"""Ты — персональный AI финансовый ассистент пользователя.
-
-📊 ФИНАНСОВАЯ СИТУАЦИЯ (30 дней):
-
-Баланс: {context.get('balance', 0):.2f} ₽
-Доход: {context.get('total_income', 0):.2f} ₽
-Расход: {context.get('total_expense', 0):.2f} ₽
-Средние траты/день: {context.get('daily_average', 0):.2f} ₽
-
-Топ категории расходов:
-{top_cats or '  (нет данных)'}
-
-Подписки:
-{subs or '  (нет)'}
-
-Транзакций: {context.get('transactions_count', 0)}
-
----
-
-🎯 ТВОИ СУПЕРСПОСОБНОСТИ:
-
-1. **Расчёт стоимости часа работы**
-   - Формула: месячный доход / (рабочие дни × 8 часов)
-   - Помогает оценить покупки в часах работы
-
-2. **Советник по покупкам**
-   - Анализируешь стоит ли покупать
-   - Учитываешь доходы, расходы, приоритеты
-   - Предлагаешь альтернативы
-
-3. **Бюджетный планировщик**
-   - Составляешь реалистичные бюджеты
-   - Находишь способы экономии
-   - Предлагаешь финансовые цели
-
-4. **Детектор аномалий**
-   - Находишь необычные траты
-   - Предупреждаешь о перерасходе
-   - Замечаешь паттерны
-
-5. **Калькулятор финансовых решений**
-   - Кредит или накопить?
-   - Вклад или инвестиции?
-   - Сравниваешь варианты с цифрами
-
-💬 СТИЛЬ ОБЩЕНИЯ:
-- Дружелюбный и мотивирующий
-- Конкретные цифры и примеры
-- Никакой воды - только суть
-- Эмодзи для наглядности (умеренно)
-- Короткие ответы (2-4 предложения), длинные только если нужно
-
-🎓 ПРИНЦИПЫ:
-- Опирайся ТОЛЬКО на реальные данные
-- Не придумывай цифры
-- Если данных мало - скажи об этом
-- Всегда давай практичные советы
-- Помогай принимать осознанные решения
-
-Отвечай на русском языке."""
-
-
-def chat_with_ai(user_message: str, context: dict, history: list = None) -> str:
-    """Общается с OpenAI"""
-    api_key = os.environ.get("OPENAI_API_KEY", "").strip()
-    if not api_key:
-        return "❌ OpenAI API key не настроен"
-    
-    # Формируем сообщения с историей
-    messages = [{"role": "system", "content": create_system_prompt(context)}]
-    
-    # Добавляем последние сообщения из истории
-    if history:
-        for msg in history[-10:]:
-            messages.append({
-                "role": msg.get("role"),
-                "content": msg.get("content")
-            })
-    
-    messages.append({"role": "user", "content": user_message})
-    
-    try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": "gpt-4o-mini",
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 1000
-            },
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            return f"❌ Ошибка AI: {response.status_code}"
-        
-        result = response.json()
-        return result["choices"][0]["message"]["content"].strip()
-        
-    except Exception as e:
-        print(f"AI error: {e}")
-        return "❌ Не удалось связаться с AI"
+# GET ?format=columnar
+HISTORY_FIELDS = ("role", "content", "created_at")
+HISTORY_DICT_FIELDS = ("role",)
 
 
 class handler(BaseHTTPRequestHandler):
@@ -200,6 +18,7 @@ class handler(BaseHTTPRequestHandler):
     - POST /api/ai-assistant - для бота (простой ответ)
     - POST /api/ai-assistant?chat=true - для приложения (с историей)
     - GET /api/ai-assistant?history=true - получить историю
+      (&format=columnar&fields=role,content - компактный вид)
     """
     
     def do_GET(self):
@@ -208,10 +27,17 @@ class handler(BaseHTTPRequestHandler):
         if user_id is None:
             return
         
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
         history = get_chat_history(user_id, limit=50)
         
+        try:
+            payload = list_payload(history, params, HISTORY_FIELDS, HISTORY_DICT_FIELDS)
+        except ValueError as e:
+            send_error(self, 400, str(e))
+            return
+        
         send_ok(self, {
-            "history": history,
+            "history": payload,
             "count": len(history)
         })
     
@@ -233,31 +59,4 @@ class handler(BaseHTTPRequestHandler):
         # Определяем режим: с историей (для приложения) или без (для бота)
         with_history = body.get("with_history", True)
         
-        log_event("ai_message", user_id, {"message": user_message[:100]})
-        
-        # Получаем контекст
-        context = get_financial_context(user_id)
-        
-        # Получаем историю если нужно
-        history = get_chat_history(user_id, limit=10) if with_history else None
-        
-        # Сохраняем сообщение пользователя (только если с историей)
-        if with_history:
-            save_chat_message(user_id, "user", user_message)
-        
-        # Получаем ответ AI
-        ai_response = chat_with_ai(user_message, context, history)
-        
-        # Сохраняем ответ AI (только если с историей)
-        if with_history:
-            save_chat_message(user_id, "assistant", ai_response)
-        
-        log_event("ai_response", user_id, {"response_len": len(ai_response)})
-        
-        send_ok(self, {
-            "message": ai_response,
-            "context": {
-                "balance": context.get("balance"),
-                "daily_average": context.get("daily_average")
-            }
-        })
+        send_ok(self, ask_assistant(user_id, user_message, with_history=with_history))
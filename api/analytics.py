@@ -0,0 +1,145 @@
+# api/analytics.py
+# Single-pass money aggregation shared by stats, export, the AI context
+# and subscriptions.
+#
+# One set of rules everywhere:
+#   - amount: numbers or numeric strings (decimal comma allowed);
+#     bool/None/garbage -> invalid (0 in totals)
+#   - type == "income" is income, anything else is an expense
+#   - empty category -> default_category
+#
+# Usage:
+#   summary = summarize(rows)                 # rows: dicts from the DB
+#                                             # (expenses or rollup buckets)
+#   summary.income, summary.expense, summary.balance
+#   summary.top_categories(5), summary.daily_average(30)
+#
+# Micro-benchmark:
+#   python -m api.analytics [rows]
+
+from __future__ import annotations
+
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def parse_amount(x: Any) -> Optional[float]:
+    """Amount as float, or None if it is not a number."""
+    if isinstance(x, bool) or x is None:
+        return None
+    if isinstance(x, (int, float)):
+        return float(x)
+    try:
+        return float(str(x).strip().replace(",", "."))
+    except ValueError:
+        return None
+
+
+def to_number(x: Any) -> float:
+    """Amount as float, 0.0 if it is not a number."""
+    value = parse_amount(x)
+    return 0.0 if value is None else value
+
+
+class Summary:
+    __slots__ = ("income", "expense", "count", "categories")
+
+    def __init__(self):
+        self.income = 0.0
+        self.expense = 0.0
+        self.count = 0
+        # expense per category
+        self.categories: Dict[str, float] = {}
+
+    @property
+    def balance(self) -> float:
+        return self.income - self.expense
+
+    def daily_average(self, days: int) -> float:
+        """Average expense per day over `days`."""
+        return round(self.expense / days, 2) if days > 0 and self.expense > 0 else 0.0
+
+    def sorted_categories(self) -> List[Tuple[str, float]]:
+        """Categories by spend desc (zero buckets dropped)."""
+        return sorted(
+            ((k, v) for k, v in self.categories.items() if v),
+            key=lambda kv: kv[1],
+            reverse=True,
+        )
+
+    def top_categories(self, n: int) -> List[Tuple[str, float]]:
+        return self.sorted_categories()[:n]
+
+
+def summarize(rows: Iterable[Dict[str, Any]], default_category: str = "Other") -> Summary:
+    """
+    Totals, per-category expense and count in one pass over a stream of
+    expense rows (dicts from the DB). Rollup buckets carry a "count"
+    column: it is added to the count instead of 1.
+    """
+    summary = Summary()
+    categories = summary.categories
+    income = 0.0
+    expense = 0.0
+    count = 0
+
+    for row in rows:
+        bucket_count = row.get("count")
+        count += 1 if bucket_count is None else int(bucket_count)
+        amount = to_number(row.get("amount"))
+        if row.get("type") == "income":
+            income += amount
+        else:
+            expense += amount
+            category = row.get("category") or default_category
+            categories[category] = categories.get(category, 0.0) + amount
+
+    summary.income = income
+    summary.expense = expense
+    summary.count = count
+    return summary
+
+
+def _legacy_multi_pass(rows: List[Dict[str, Any]]) -> Tuple[float, float, Dict[str, float]]:
+    """The previous pattern: one generator pass per total, another for categories."""
+    total_income = sum(to_number(t.get("amount")) for t in rows if t.get("type") == "income")
+    total_expense = sum(to_number(t.get("amount")) for t in rows if t.get("type") != "income")
+    categories: Dict[str, float] = {}
+    for t in rows:
+        if t.get("type") != "income":
+            cat = t.get("category") or "Other"
+            categories[cat] = categories.get(cat, 0.0) + to_number(t.get("amount"))
+    return total_income, total_expense, categories
+
+
+def _benchmark(n: int = 200_000, repeat: int = 5) -> None:
+    cats = ["Еда", "Транспорт", "Кафе", "Продукты", "Разное", None]
+    rows = [
+        {
+            "amount": str(100 + i % 900) if i % 3 else 100 + i % 900,
+            "type": "income" if i % 10 == 0 else "expense",
+            "category": cats[i % len(cats)],
+            "created_at": "2024-01-01T00:00:00+00:00",
+        }
+        for i in range(n)
+    ]
+
+    def best(fn) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
+
+    legacy_ms = best(lambda: _legacy_multi_pass(rows))
+    dicts_ms = best(lambda: summarize(rows))
+
+    print(f"rows={n} (best of {repeat})")
+    print(f"  legacy multi-pass       {legacy_ms:8.1f} ms")
+    print(f"  summarize               {dicts_ms:8.1f} ms  x{legacy_ms / dicts_ms:.2f}")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,189 @@
+# api/assistant.py - AI ассистент: контекст, история, запрос к OpenAI
+# Используется из ai-assistant.py (HTTP) и bot.py (через api.services)
+import os
+from datetime import datetime, timedelta
+
+from api import http_client
+from api.analytics import summarize
+from api.db import get_supabase_for_user, run_parallel
+
+
+def get_chat_history(user_id: int, limit: int = 10) -> list:
+    """Получает историю чата из БД"""
+    supabase = get_supabase_for_user(user_id)
+    
+    try:
+        result = supabase.table("ai_chat_history") \
+            .select("*") \
+            .eq("user_id", user_id) \
+            .order("created_at", desc=True) \
+            .limit(limit) \
+            .execute()
+        
+        return list(reversed(result.data)) if result.data else []
+    except:
+        return []
+
+
+def save_chat_message(user_id: int, role: str, content: str):
+    """Сохраняет сообщение в БД"""
+    supabase = get_supabase_for_user(user_id)
+    
+    try:
+        supabase.table("ai_chat_history").insert({
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.now().isoformat()
+        }).execute()
+    except Exception as e:
+        print(f"Save chat error: {e}")
+
+
+def get_financial_context(user_id: int) -> dict:
+    """
+    Собирает финансовый контекст. Суммы за 30 дней берутся из дневных
+    свёрток (sql/005_expense_rollups.sql): O(дни × категории), а не O(операции).
+    """
+    supabase = get_supabase_for_user(user_id)
+    date_from = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d')
+    
+    try:
+        # Свёртки и подписки — параллельно
+        result, subs_result = run_parallel(
+            lambda: supabase.table("expense_rollup_daily")
+                .select("type, category, amount, count")
+                .eq("user_id", user_id)
+                .gte("day", date_from)
+                .execute(),
+            lambda: supabase.table("subscriptions").select("*").execute(),
+        )
+        buckets = result.data or []
+        subscriptions = subs_result.data or []
+        
+        # Статистика — один проход по корзинам свёрток
+        summary = summarize(buckets, default_category="Разное")
+        
+        return {
+            "balance": summary.balance,
+            "total_income": summary.income,
+            "total_expense": summary.expense,
+            "daily_average": summary.daily_average(30),
+            "top_categories": [{"category": c, "amount": a} for c, a in summary.top_categories(5)],
+            "subscriptions": [{"name": s['name'], "amount": s['amount']} for s in subscriptions],
+            "transactions_count": summary.count
+        }
+    except Exception as e:
+        print(f"Context error: {e}")
+        return {}
+
+
+def create_system_prompt(context: dict) -> str:
+    """Создаёт системный промпт"""
+    
+    top_cats = "\n".join([f"  - {c['category']}: {c['amount']:.2f} ₽" for c in context.get('top_categories', [])])
+    subs = "\n".join([f"  - {s['name']}: {s['amount']} ₽" for s in context.get('subscriptions', [])])
+    
+    return f"""Ты — персональный AI финансовый ассистент пользователя.
+
+📊 ФИНАНСОВАЯ СИТУАЦИЯ (30 дней):
+
+Баланс: {context.get('balance', 0):.2f} ₽
+Доход: {context.get('total_income', 0):.2f} ₽
+Расход: {context.get('total_expense', 0):.2f} ₽
+Средние траты/день: {context.get('daily_average', 0):.2f} ₽
+
+Топ категории расходов:
+{top_cats or '  (нет данных)'}
+
+Подписки:
+{subs or '  (нет)'}
+
+Транзакций: {context.get('transactions_count', 0)}
+
+---
+
+🎯 ТВОИ СУПЕРСПОСОБНОСТИ:
+
+1. **Расчёт стоимости часа работы**
+   - Формула: месячный доход / (рабочие дни × 8 часов)
+   - Помогает оценить покупки в часах работы
+
+2. **Советник по покупкам**
+   - Анализируешь стоит ли покупать
+   - Учитываешь доходы, расходы, приоритеты
+   - Предлагаешь альтернативы
+
+3. **Бюджетный планировщик**
+   - Составляешь реалистичные бюджеты
+   - Находишь способы экономии
+   - Предлагаешь финансовые цели
+
+4. **Детектор аномалий**
+   - Находишь необычные траты
+   - Предупреждаешь о перерасходе
+   - Замечаешь паттерны
+
+5. **Калькулятор финансовых решений**
+   - Кредит или накопить?
+   - Вклад или инвестиции?
+   - Сравниваешь варианты с цифрами
+
+💬 СТИЛЬ ОБЩЕНИЯ:
+- Дружелюбный и мотивирующий
+- Конкретные цифры и примеры
+- Никакой воды - только суть
+- Эмодзи для наглядности (умеренно)
+- Короткие ответы (2-4 предложения), длинные только если нужно
+
+🎓 ПРИНЦИПЫ:
+- Опирайся ТОЛЬКО на реальные данные
+- Не придумывай цифры
+- Если данных мало - скажи об этом
+- Всегда давай практичные советы
+- Помогай принимать осознанные решения
+
+Отвечай на русском языке."""
+
+
+def chat_with_ai(user_message: str, context: dict, history: list = None) -> str:
+    """Общается с OpenAI"""
+    api_key = os.environ.get("OPENAI_API_KEY", "").strip()
+    if not api_key:
+        return "❌ OpenAI API key не настроен"
+    
+    # Формируем сообщения с историей
+    messages = [{"role": "system", "content": create_system_prompt(context)}]
+    
+    # Добавляем последние сообщения из истории
+    if history:
+        for msg in history[-10:]:
+            messages.append({
+                "role": msg.get("role"),
+                "content": msg.get("content")
+            })
+    
+    messages.append({"role": "user", "content": user_message})
+    
+    try:
+        response = http_client.post(
+            "https://api.openai.com/v1/chat/completions",
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            json={
+                "model": "gpt-4o-mini",
+                "messages": messages,
+                "temperature": 0.7,
+                "max_tokens": 1000
+            },
+            timeout=30
+        )
+        
+        if response.status_code != 200:
+            return f"❌ Ошибка AI: {response.status_code}"
+        
+        result = response.json()
+        return result["choices"][0]["message"]["content"].strip()
+        
+    except Exception as e:
+        print(f"AI error: {e}")
+        return "❌ Не удалось связаться с AI"
@@ -1,14 +1,32 @@
 # api/bot.py - автоматический AI режим
 from http.server import BaseHTTPRequestHandler
+import calendar
 import os
 import json
-import requests
+import re
+from contextvars import ContextVar
 from datetime import datetime
 
+from api import http_client
+from api.db import get_supabase_for_user
+from api.dedup import claim, mark_done, release
+from api.logger import log_event
+from api.rate_limiter import check_rate_limit
+from api.reports import FORMATS, iter_expense_pages, load_header, parse_export_params
+from api.services import (
+    ServiceError, ask_assistant, build_expense, create_expense, get_stats, insert_expenses,
+)
+from api.update_queue import get_update_queue
+
 # Конфигурация
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 API_BASE_URL = os.environ.get("API_BASE_URL", "")
 WEBAPP_URL = f"{API_BASE_URL}/index.html"
+MAX_BATCH_LINES = 50  # строк в одном сообщении с несколькими операциями
+EXPORT_RATE_COST = 5  # выгрузка тяжелее обычного сообщения
+EXPORT_UPLOAD_TIMEOUT = 120
+# Вебхук без очереди строит отчёт синхронно — только за короткий период
+INLINE_EXPORT_MAX_DAYS = 31
 
 # Категории для распознавания расходов
 EXPENSE_CATEGORIES = {
@@ -18,20 +36,31 @@ EXPENSE_CATEGORIES = {
 }
 
 
-def create_init_data(user_id: int) -> str:
-    """Создаёт initData для API"""
-    user_data = json.dumps({"id": user_id, "first_name": "User", "is_bot": False})
-    return f"user={user_data}"
+# Ответ через тело ответа вебхука (см. process_update_inline).
+# Держим последнее сообщение; если появляется следующее — предыдущее
+# уходит обычным sendMessage, так порядок сообщений сохраняется.
+_inline_reply: ContextVar[list | None] = ContextVar("_inline_reply", default=None)
 
 
 def send_message(chat_id: int, text: str, reply_markup=None):
     """Отправляет сообщение"""
+    payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
+    if reply_markup:
+        payload["reply_markup"] = reply_markup
+    
+    held = _inline_reply.get()
+    if held is not None:
+        if held:
+            _post_message(held.pop())
+        held.append(payload)
+        return True
+    
+    return _post_message(payload)
+
+
+def _post_message(payload: dict) -> bool:
     try:
-        payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
-        if reply_markup:
-            payload["reply_markup"] = reply_markup
-        
-        response = requests.post(
+        response = http_client.post(
             f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
             json=payload, timeout=10
         )
@@ -44,7 +73,7 @@ def send_message(chat_id: int, text: str, reply_markup=None):
 def send_chat_action(chat_id: int, action: str = "typing"):
     """Индикатор печати"""
     try:
-        requests.post(
+        http_client.post(
             f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendChatAction",
             json={"chat_id": chat_id, "action": action}, timeout=5
         )
@@ -52,6 +81,30 @@ def send_chat_action(chat_id: int, action: str = "typing"):
         pass
 
 
+def send_document(chat_id: int, filename: str, content_type: str, chunks, caption: str = None) -> bool:
+    """
+    sendDocument с потоковым multipart-телом: файл уходит в Telegram по
+    мере генерации и целиком в памяти не лежит.
+    """
+    multipart_type, body = http_client.multipart_stream(
+        {"chat_id": chat_id, "caption": caption},
+        "document", filename, content_type, chunks,
+    )
+    try:
+        response = http_client.post(
+            f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument",
+            data=body, headers={"Content-Type": multipart_type}, timeout=EXPORT_UPLOAD_TIMEOUT,
+            # Тело — одноразовый генератор: повтор ушёл бы пустым
+            retries=0,
+        )
+        if response.status_code != 200:
+            print(f"Send document error: {response.status_code} {response.text[:200]}")
+        return response.status_code == 200
+    except Exception as e:
+        print(f"Send document error: {e}")
+        return False
+
+
 def parse_expense_text(text: str) -> dict | None:
     """Парсит: 500 Кофе"""
     parts = text.strip().split(maxsplit=1)
@@ -83,23 +136,28 @@ def parse_expense_text(text: str) -> dict | None:
     return {"amount": amount, "description": description, "category": category}
 
 
+def parse_expense_line(line: str) -> tuple[bool, dict] | None:
+    """Одна строка операции: (is_income, parsed) или None. "+" в начале — доход"""
+    line = line.strip()
+    is_income = line.startswith('+')
+    parsed = parse_expense_text(line[1:].strip() if is_income else line)
+    if not parsed:
+        return None
+    return is_income, parsed
+
+
 def is_expense_format(text: str) -> bool:
-    """Проверяет похоже ли на формат расхода"""
-    # Примеры: "500 Кофе", "Такси 300", "+ 50000 Зарплата"
-    parts = text.strip().split(maxsplit=1)
-    if len(parts) < 2:
+    """
+    Проверяет похоже ли на формат расхода — тем же парсером, что и
+    добавление. Примеры: "500 Кофе", "Такси 300", "+ 50000 Зарплата".
+    Несколько строк — пакет, если операциями распознана хотя бы половина
+    строк (остальные handle_expense_batch покажет как нераспознанные).
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
         return False
-    
-    # Проверяем есть ли число в первом или втором слове
-    try:
-        float(parts[0].replace(',', '.').replace('+', ''))
-        return True
-    except ValueError:
-        try:
-            float(parts[1].replace(',', '.'))
-            return True
-        except ValueError:
-            return False
+    parsed = sum(1 for line in lines if parse_expense_line(line) is not None)
+    return parsed * 2 >= len(lines)
 
 
 def handle_start(chat_id: int):
@@ -140,7 +198,8 @@ def handle_help(chat_id: int):
         "• Сколько стоит час моей работы?\n\n"
         "📱 *Команды:*\n"
         "/start - главное меню\n"
-        "/stats - статистика\n\n"
+        "/stats - статистика\n"
+        "/export - отчёт файлом (`/export xlsx 2024-05`)\n\n"
         "_Просто пиши что хочешь - я пойму!_ 😊"
     )
 
@@ -148,100 +207,325 @@ def handle_help(chat_id: int):
 def handle_stats(chat_id: int, user_id: int):
     """Команда /stats"""
     try:
-        init_data = create_init_data(user_id)
-        response = requests.get(
-            f"{API_BASE_URL}/api/stats?period=month",
-            headers={"X-Tg-Init-Data": init_data}, timeout=10
-        )
+        data, _ = get_stats(user_id, "month")
+        balance = data.get('total_balance', 0)
+        income = data.get('period', {}).get('income', 0)
+        expense = data.get('period', {}).get('expense', 0)
         
-        if response.status_code == 200:
-            data = response.json().get('data', {})
-            balance = data.get('total_balance', 0)
-            income = data.get('period', {}).get('income', 0)
-            expense = data.get('period', {}).get('expense', 0)
-            
-            send_message(
-                chat_id,
-                f"📊 *Статистика за месяц:*\n\n"
-                f"💰 Баланс: `{balance} ₽`\n"
-                f"📈 Доход: `+{income} ₽`\n"
-                f"📉 Расход: `-{expense} ₽`"
-            )
-        else:
-            send_message(chat_id, "❌ Не удалось загрузить статистику")
+        send_message(
+            chat_id,
+            f"📊 *Статистика за месяц:*\n\n"
+            f"💰 Баланс: `{balance} ₽`\n"
+            f"📈 Доход: `+{income} ₽`\n"
+            f"📉 Расход: `-{expense} ₽`"
+        )
+    except ServiceError:
+        send_message(chat_id, "❌ Не удалось загрузить статистику")
     except Exception as e:
         print(f"Stats error: {e}")
         send_message(chat_id, "❌ Ошибка")
 
 
+def parse_export_args(args: list) -> dict | None:
+    """
+    Аргументы /export в любом порядке: формат (csv|jsonl|xlsx) и период —
+    месяц `2024-05` или даты `2024-05-01 [2024-05-31]`.
+    Возвращает параметры для reports.parse_export_params или None.
+    """
+    params = {"format": "csv"}
+    dates = []
+    for arg in args:
+        arg = arg.lower()
+        if arg in FORMATS:
+            params["format"] = arg
+        elif re.fullmatch(r"\d{4}-\d{2}", arg):
+            year, month = int(arg[:4]), int(arg[5:])
+            if not 1 <= month <= 12:
+                return None
+            dates.append(f"{arg}-01")
+            dates.append(f"{arg}-{calendar.monthrange(year, month)[1]:02d}")
+        elif re.fullmatch(r"\d{4}-\d{2}-\d{2}", arg):
+            dates.append(arg)
+        else:
+            return None
+    if len(dates) > 2:
+        return None
+    if dates:
+        params["from"] = dates[0]
+        params["to"] = dates[-1]
+    return params
+
+
+def _export_document(chat_id: int, user_id: int, options: dict):
+    """Строит отчёт из общего потокового конвейера и отправляет документом"""
+    export_format = FORMATS[options["format"]]
+    period = ""
+    if options.get("from"):
+        period = f"_{options['from']:%Y-%m-%d}_{options['to']:%Y-%m-%d}"
+    filename = f"finance_report{period}.{export_format.extension}"
+    send_chat_action(chat_id, "upload_document")
+    
+    try:
+        supabase = get_supabase_for_user(user_id)
+        header = load_header(supabase, user_id, options)
+        chunks = export_format.render(header, iter_expense_pages(supabase, user_id, options))
+        caption = f"📄 Отчёт{' за ' + header.period if header.period else ''}"
+        sent = send_document(chat_id, filename, export_format.content_type, chunks, caption)
+    except Exception as e:
+        log_event("bot_export_failed", user_id, {"error": str(e)}, "error")
+        sent = False
+    
+    if not sent:
+        send_message(chat_id, "❌ Не удалось подготовить отчёт")
+
+
+def handle_export(chat_id: int, user_id: int, text: str):
+    """
+    Команда /export [csv|jsonl|xlsx] [2024-05 | 2024-05-01 2024-05-31].
+    В вебхуке без очереди процесс замораживается сразу после ответа
+    Telegram, поэтому отчёт строится синхронно, внутри вызова вебхука, и
+    только за ограниченный период: не больше INLINE_EXPORT_MAX_DAYS дней
+    (без периода — текущий месяц). В режиме очереди и в bot_worker — любой
+    период.
+    """
+    params = parse_export_args(text.split()[1:])
+    if params is None:
+        send_message(
+            chat_id,
+            "📄 *Выгрузка отчёта:*\n"
+            "• `/export` - CSV\n"
+            "• `/export xlsx 2024-05` - за месяц\n"
+            "• `/export jsonl 2024-05-01 2024-05-15` - за период"
+        )
+        return
+    
+    inline = _inline_reply.get() is not None
+    if inline and "from" not in params:
+        today = datetime.now()
+        params["from"] = f"{today:%Y-%m}-01"
+        params["to"] = f"{today:%Y-%m}-{calendar.monthrange(today.year, today.month)[1]:02d}"
+    
+    try:
+        options = parse_export_params(params)
+    except ServiceError:
+        send_message(chat_id, "❌ Неверный период: начало позже конца или дата некорректна")
+        return
+    
+    if inline and (options["to"] - options["from"]).days + 1 > INLINE_EXPORT_MAX_DAYS:
+        send_message(
+            chat_id,
+            "📄 В боте выгружаю не больше месяца за раз.\n"
+            "Раздели период или скачай весь отчёт в приложении: «📥 Скачать отчет»."
+        )
+        return
+    
+    allowed, _ = check_rate_limit(user_id, cost=EXPORT_RATE_COST)
+    if not allowed:
+        send_message(chat_id, "⏳ Слишком много запросов. Подожди минуту.")
+        return
+    
+    # В вебхуке «⏳» ушёл бы телом ответа уже после документа — там
+    # хватает индикатора «отправляет файл» из _export_document
+    if not inline:
+        send_message(chat_id, "⏳ Готовлю отчёт...")
+    _export_document(chat_id, user_id, options)
+
+
+def _format_amount(amount: float) -> str:
+    """500.0 -> "500" (иначе index-парсер склеит цифры в 5000)"""
+    return str(int(amount)) if float(amount).is_integer() else str(amount)
+
+
 def handle_expense(chat_id: int, user_id: int, text: str):
     """Добавление расхода/дохода"""
-    is_income = text.startswith('+')
-    if is_income:
-        text = text[1:].strip()
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        return handle_expense_batch(chat_id, user_id, lines)
     
-    parsed = parse_expense_text(text)
-    if not parsed:
+    line = parse_expense_line(text)
+    if line is None:
         return False  # Не получилось распарсить
+    is_income, parsed = line
+    
+    allowed, _ = check_rate_limit(user_id)
+    if not allowed:
+        send_message(chat_id, "⏳ Слишком много запросов. Подожди минуту.")
+        return True
     
     try:
-        init_data = create_init_data(user_id)
-        response = requests.post(
-            f"{API_BASE_URL}/api/index",
-            headers={"X-Tg-Init-Data": init_data},
-            json={
-                "text": f"{parsed['amount']} {parsed['description']}",
-                "type": "income" if is_income else "expense",
-                "date": datetime.now().strftime('%Y-%m-%d')
-            },
-            timeout=10
+        create_expense(
+            user_id,
+            f"{_format_amount(parsed['amount'])} {parsed['description']}",
+            record_type="income" if is_income else "expense",
+            date=datetime.now().strftime('%Y-%m-%d')
         )
         
-        if response.status_code == 200:
-            emoji = "📈" if is_income else "💸"
-            sign = "+" if is_income else "-"
-            
-            send_message(
-                chat_id,
-                f"✅ Добавлено:\n{emoji} {sign}{parsed['amount']} ₽\n"
-                f"📝 {parsed['description']}\n📂 {parsed['category']}"
-            )
-            return True
-        else:
-            send_message(chat_id, "❌ Не удалось добавить")
-            return True
+        emoji = "📈" if is_income else "💸"
+        sign = "+" if is_income else "-"
+        
+        send_message(
+            chat_id,
+            f"✅ Добавлено:\n{emoji} {sign}{parsed['amount']} ₽\n"
+            f"📝 {parsed['description']}\n📂 {parsed['category']}"
+        )
+        return True
+    except ServiceError:
+        send_message(chat_id, "❌ Не удалось добавить")
+        return True
     except Exception as e:
         print(f"Add error: {e}")
         send_message(chat_id, "❌ Ошибка")
         return True
 
 
+def handle_expense_batch(chat_id: int, user_id: int, lines: list):
+    """Несколько операций в одном сообщении (по одной на строку) — один insert"""
+    if len(lines) > MAX_BATCH_LINES:
+        send_message(chat_id, f"❌ Не больше {MAX_BATCH_LINES} строк за раз")
+        return True
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    rows = []
+    added = []
+    skipped = []
+    
+    for line in lines:
+        result = parse_expense_line(line)
+        if result is None:
+            skipped.append(line)
+            continue
+        is_income, parsed = result
+        try:
+            rows.append(build_expense(
+                user_id,
+                f"{_format_amount(parsed['amount'])} {parsed['description']}",
+                record_type="income" if is_income else "expense",
+                date=today
+            ))
+        except ServiceError:
+            skipped.append(line)
+            continue
+        added.append((is_income, parsed))
+    
+    if not rows:
+        return False  # Ни одна строка не распарсилась
+    
+    allowed, _ = check_rate_limit(user_id)
+    if not allowed:
+        send_message(chat_id, "⏳ Слишком много запросов. Подожди минуту.")
+        return True
+    
+    try:
+        insert_expenses(user_id, rows)
+    except ServiceError:
+        send_message(chat_id, "❌ Не удалось добавить")
+        return True
+    except Exception as e:
+        print(f"Batch add error: {e}")
+        send_message(chat_id, "❌ Ошибка")
+        return True
+    
+    total_income = sum(p['amount'] for inc, p in added if inc)
+    total_expense = sum(p['amount'] for inc, p in added if not inc)
+    
+    summary = [f"✅ Добавлено записей: {len(added)}"]
+    for is_income, parsed in added:
+        emoji = "📈" if is_income else "💸"
+        sign = "+" if is_income else "-"
+        summary.append(f"{emoji} {sign}{_format_amount(parsed['amount'])} ₽ — {parsed['description']} ({parsed['category']})")
+    summary.append("")
+    if total_expense:
+        summary.append(f"📉 Расход: -{_format_amount(total_expense)} ₽")
+    if total_income:
+        summary.append(f"📈 Доход: +{_format_amount(total_income)} ₽")
+    if skipped:
+        summary.append("")
+        summary.append("⚠️ Не распознано:")
+        summary.extend(f"• {line}" for line in skipped)
+    
+    send_message(chat_id, "\n".join(summary))
+    return True
+
+
 def handle_ai_message(chat_id: int, user_id: int, text: str):
     """Обработка через AI"""
     send_chat_action(chat_id, "typing")
     
     try:
-        init_data = create_init_data(user_id)
-        response = requests.post(
-            f"{API_BASE_URL}/api/ai-assistant",
-            json={"message": text},
-            headers={"X-Tg-Init-Data": init_data},
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            data = response.json().get('data', {})
-            ai_message = data.get('message', 'Не удалось получить ответ')
-            send_message(chat_id, f"🤖 {ai_message}")
-        else:
-            send_message(chat_id, "❌ AI временно недоступен")
+        data = ask_assistant(user_id, text)
+        ai_message = data.get('message', 'Не удалось получить ответ')
+        send_message(chat_id, f"🤖 {ai_message}")
     except Exception as e:
         print(f"AI error: {e}")
         send_message(chat_id, "❌ Не удалось связаться с AI")
 
 
+def _extract_message(update: dict):
+    """(chat_id, user_id, text) из update или None, если обрабатывать нечего"""
+    message = update.get('message') or {}
+    chat_id = message.get('chat', {}).get('id')
+    user_id = message.get('from', {}).get('id')
+    text = message.get('text', '')
+    
+    if not chat_id or not text:
+        return None
+    return chat_id, user_id, text
+
+
+def process_update(update: dict):
+    """Маршрутизирует один update Telegram по обработчикам"""
+    extracted = _extract_message(update)
+    if extracted is None:
+        return
+    chat_id, user_id, text = extracted
+    
+    print(f"User {user_id}: {text}")
+    
+    # Команды
+    if text == '/start':
+        handle_start(chat_id)
+    elif text == '/help':
+        handle_help(chat_id)
+    elif text == '/stats':
+        handle_stats(chat_id, user_id)
+    elif text == '/export' or text.startswith('/export '):
+        handle_export(chat_id, user_id, text)
+    
+    # Проверяем формат расхода/дохода
+    elif is_expense_format(text):
+        # Это похоже на расход - добавляем
+        handle_expense(chat_id, user_id, text)
+    
+    # Всё остальное - отправляем в AI
+    else:
+        handle_ai_message(chat_id, user_id, text)
+
+
+def process_update_inline(update: dict) -> dict | None:
+    """
+    Как process_update, но последнее сообщение не отправляется, а
+    возвращается как вызов метода для тела ответа вебхука:
+    {"method": "sendMessage", ...}. Экономит один запрос к Telegram.
+    """
+    held = []
+    token = _inline_reply.set(held)
+    try:
+        process_update(update)
+    finally:
+        _inline_reply.reset(token)
+    
+    if not held:
+        return None
+    return {"method": "sendMessage", **held[0]}
+
+
 class handler(BaseHTTPRequestHandler):
-    """Webhook handler"""
+    """
+    Webhook handler.
+    При BOT_QUEUE_BACKEND=sqlite|supabase только кладёт update в очередь
+    и сразу отвечает 200; обработку делает воркер (python -m api.update_queue).
+    Если очередь недоступна — 503, чтобы Telegram доставил update повторно.
+    """
     
     def do_POST(self):
         try:
@@ -249,39 +533,43 @@ class handler(BaseHTTPRequestHandler):
             body = self.rfile.read(content_length)
             data = json.loads(body.decode('utf-8'))
             
-            message = data.get('message', {})
-            chat_id = message.get('chat', {}).get('id')
-            user_id = message.get('from', {}).get('id')
-            text = message.get('text', '')
-            
-            if not chat_id or not text:
+            # Повторная доставка того же update (уже обработан или ещё
+            # обрабатывается) — отбрасываем до любой работы
+            if not isinstance(data, dict) or not claim(data.get('update_id')):
+                print(f"Duplicate update skipped: {data.get('update_id') if isinstance(data, dict) else None}")
                 self.send_response(200)
                 self.end_headers()
                 return
             
-            print(f"User {user_id}: {text}")
-            
-            # Команды
-            if text == '/start':
-                handle_start(chat_id)
-            elif text == '/help':
-                handle_help(chat_id)
-            elif text == '/stats':
-                handle_stats(chat_id, user_id)
-            
-            # Проверяем формат расхода/дохода
-            elif is_expense_format(text):
-                # Это похоже на расход - добавляем
-                handle_expense(chat_id, user_id, text)
+            if _extract_message(data) is None:
+                mark_done(data.get('update_id'))
+                self.send_response(200)
+                self.end_headers()
+                return
             
-            # Всё остальное - отправляем в AI
+            reply = None
+            queue = get_update_queue()
+            if queue is not None:
+                try:
+                    queue.enqueue(data)
+                except Exception as e:
+                    # Не отвечаем 200: Telegram повторит доставку позже
+                    log_event("bot_enqueue_failed", 0, {"update_id": data.get('update_id'), "error": str(e)}, "error")
+                    release(data.get('update_id'))
+                    self.send_response(503)
+                    self.end_headers()
+                    return
             else:
-                handle_ai_message(chat_id, user_id, text)
+                reply = process_update_inline(data)
+            # Захват -> done только после успешной постановки в очередь / обработки
+            mark_done(data.get('update_id'))
             
+            body = json.dumps(reply or {"ok": True}, ensure_ascii=False).encode('utf-8')
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(json.dumps({"ok": True}).encode())
+            self.wfile.write(body)
             
         except Exception as e:
             print(f"Webhook error: {e}")
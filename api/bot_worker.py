@@ -0,0 +1,178 @@
+# api/bot_worker.py
+# Long-polling entry point for self-hosted deployments:
+#
+#   python -m api.bot_worker
+#
+# Pulls updates in batches with getUpdates and processes them concurrently
+# on asyncio, reusing bot.process_update (parse_expense_text,
+# is_expense_format and the command handlers). Guarantees:
+#   - updates of the same chat are processed strictly in arrival order
+#   - at most BOT_WORKER_CONCURRENCY updates are processed at once
+#   - at most BOT_WORKER_MAX_PENDING updates are in flight; polling pauses
+#     when the backlog is full
+#   - an update is confirmed to Telegram (getUpdates offset) only once it and
+#     every earlier one are processed: after a crash or restart the
+#     unfinished ones are delivered again (at-least-once; some finished
+#     later ones may repeat). Re-polled updates already in flight are skipped;
+#     at most BATCH_LIMIT updates past the oldest unfinished one are seen.
+#   - on SIGINT/SIGTERM polling stops, in-flight updates are awaited and the
+#     final offset is committed
+#
+# getUpdates does not work while a webhook is set (Telegram answers 409);
+# set BOT_WORKER_DELETE_WEBHOOK=1 to remove it on start.
+
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Set
+
+from api import http_client
+from api.bot import TELEGRAM_BOT_TOKEN, process_update
+from api.logger import log_event
+
+CONCURRENCY = int(os.environ.get("BOT_WORKER_CONCURRENCY", "32"))
+MAX_PENDING = int(os.environ.get("BOT_WORKER_MAX_PENDING", "500"))
+POLL_TIMEOUT = 25  # seconds, Telegram long polling
+BATCH_LIMIT = 100  # max allowed by getUpdates
+ERROR_BACKOFF_SECONDS = 3
+IDLE_WAIT_SECONDS = 1.0
+
+
+def _api_url(method: str) -> str:
+    return f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/{method}"
+
+
+def get_updates(offset: int, limit: int = BATCH_LIMIT, timeout: int = POLL_TIMEOUT) -> List[Dict[str, Any]]:
+    """Blocking getUpdates call (run it in a thread). Confirms updates below offset."""
+    response = http_client.post(
+        _api_url("getUpdates"),
+        json={
+            "offset": offset,
+            "limit": limit,
+            "timeout": timeout,
+            "allowed_updates": ["message"],
+        },
+        timeout=timeout + 10,
+    )
+    payload = response.json()
+    if not payload.get("ok"):
+        raise RuntimeError(f"getUpdates failed: {response.status_code} {payload.get('description')}")
+    return payload.get("result") or []
+
+
+def _chat_id(update: Dict[str, Any]):
+    return ((update.get("message") or {}).get("chat") or {}).get("id")
+
+
+class BotWorker:
+    def __init__(self, concurrency: int = CONCURRENCY, max_pending: int = MAX_PENDING):
+        self.concurrency = concurrency
+        # Следующий update_id, который ещё не брали в работу
+        self.next_update_id = 0
+        self.processed = 0
+        self.failed = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._pending = asyncio.Semaphore(max_pending)
+        # chat_id -> [lock, users]; лок удаляется, когда чат никто не ждёт
+        self._chat_locks: Dict[Any, list] = {}
+        # Ссылки на задачи (asyncio держит только слабые) и update_id в работе
+        self._tasks: Set[asyncio.Task] = set()
+        self._in_flight: Set[int] = set()
+
+    @property
+    def offset(self) -> int:
+        """getUpdates offset: confirms only updates below the oldest unfinished one."""
+        return min(self._in_flight) if self._in_flight else self.next_update_id
+
+    async def _handle(self, update: Dict[str, Any]) -> None:
+        chat_id = _chat_id(update)
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock будит ожидающих в порядке FIFO, а задачи стартуют
+            # в порядке создания — поэтому порядок внутри чата сохраняется
+            async with entry[0]:
+                async with self._slots:
+                    await asyncio.to_thread(process_update, update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            log_event("bot_worker_update_failed", 0, {"update_id": update.get("update_id"), "error": str(e)}, "error")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chat_locks.pop(chat_id, None)
+            self._in_flight.discard(update.get("update_id"))
+            self._pending.release()
+
+    async def _dispatch(self, updates: List[Dict[str, Any]]) -> int:
+        """Starts handling of updates not taken yet; returns how many were new."""
+        started = 0
+        for update in updates:
+            update_id = update.get("update_id", 0)
+            # offset держится на самом старом незавершённом update, поэтому
+            # getUpdates возвращает и те, что уже в работе
+            if update_id < self.next_update_id:
+                continue
+            self.next_update_id = update_id + 1
+            await self._pending.acquire()
+            self._in_flight.add(update_id)
+            task = asyncio.create_task(self._handle(update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            started += 1
+        return started
+
+    async def _shutdown(self) -> None:
+        """Awaits in-flight updates, then commits the final offset."""
+        if self._tasks:
+            log_event("bot_worker_draining", 0, {"in_flight": len(self._tasks)})
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        try:
+            await asyncio.to_thread(get_updates, self.offset, 1, 0)
+        except Exception as e:
+            log_event("bot_worker_commit_error", 0, {"offset": self.offset, "error": str(e)}, "warning")
+        log_event("bot_worker_stopped", 0, {"processed": self.processed, "failed": self.failed, "offset": self.offset})
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency + 1))
+
+        if os.environ.get("BOT_WORKER_DELETE_WEBHOOK") == "1":
+            await asyncio.to_thread(http_client.post, _api_url("deleteWebhook"), json={})
+
+        main_task = asyncio.current_task()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows / не главный поток
+
+        log_event("bot_worker_started", 0, {"concurrency": self.concurrency})
+        try:
+            while True:
+                try:
+                    updates = await asyncio.to_thread(get_updates, self.offset)
+                except Exception as e:
+                    log_event("bot_worker_poll_error", 0, {"error": str(e)}, "warning")
+                    await asyncio.sleep(ERROR_BACKOFF_SECONDS)
+                    continue
+                if updates and not await self._dispatch(updates) and self._tasks:
+                    # Вернулись только updates, которые уже в работе: ждём,
+                    # пока что-то завершится, а не крутим getUpdates впустую
+                    await asyncio.wait(self._tasks, timeout=IDLE_WAIT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            await asyncio.shield(self._shutdown())
+
+
+def main() -> None:
+    try:
+        asyncio.run(BotWorker().run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
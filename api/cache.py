@@ -0,0 +1,191 @@
+# api/cache.py
+# Per-user response cache with write-driven invalidation.
+#
+# Every user has a version counter. Writers (index, delete, process-receipt
+# via services.insert_expenses, subs, settings) call bump_user_version();
+# cached entries are keyed by the version, so a bump makes all of the
+# user's cached responses unreachable at once. TTL and LRU bounds keep the
+# store small.
+#
+# Backends (CACHE_BACKEND):
+#   "redis"  - shared store (REDIS_URL), needs the redis package. Default
+#              when REDIS_URL is set.
+#   "off"    - no caching. Default otherwise.
+#   "memory" - in-process. Only for single-process deployments (self-hosted
+#              bot worker, local runs): on Vercel every api/*.py file is its
+#              own function with its own process, so bumps made by index.py,
+#              delete.py, subs.py, ... never reach the process serving
+#              stats.py, which would return stale totals for the whole TTL.
+#
+# If the redis backend cannot be created, caching is off (not in-process).
+#
+# Hit/miss counters are logged every STATS_LOG_INTERVAL seconds as
+# "cache_stats".
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from api.logger import log_event, log_stats_periodically
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "redis" if os.environ.get("REDIS_URL") else "off").lower()
+CACHE_TTL = int(os.environ.get("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "2000"))
+# Версии живут дольше значений: потеря версии = сброс кэша пользователя
+VERSION_TTL = 7 * 24 * 3600
+
+
+class InProcessBackend:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._values: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._versions: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        with self._lock:
+            self._values[key] = (time.time() + ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def get_version(self, key: str) -> int:
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            version = self._versions.get(key, 0) + 1
+            self._versions[key] = version
+            self._versions.move_to_end(key)
+            while len(self._versions) > self.max_entries:
+                self._versions.popitem(last=False)
+            return version
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        import redis  # optional dependency
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._redis.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        self._redis.set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+    def get_version(self, key: str) -> int:
+        raw = self._redis.get(key)
+        return int(raw) if raw is not None else 0
+
+    def incr(self, key: str) -> int:
+        pipe = self._redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, VERSION_TTL)
+        return int(pipe.execute()[0])
+
+
+_backend = None
+_backend_ready = False
+_counters: Dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def get_backend():
+    """Configured backend or None when caching is off / unavailable."""
+    global _backend, _backend_ready
+    if not _backend_ready:
+        _backend_ready = True
+        try:
+            if CACHE_BACKEND == "redis":
+                _backend = RedisBackend(os.environ["REDIS_URL"])
+            elif CACHE_BACKEND == "memory":
+                _backend = InProcessBackend()
+        except Exception as e:
+            # Без общего хранилища не кэшируем: версии в памяти процесса
+            # не видят инвалидаций из других функций
+            log_event("cache_backend_unavailable", 0, {"backend": CACHE_BACKEND, "error": str(e)}, "warning")
+            _backend = None
+    return _backend
+
+
+def _version_key(user_id: int) -> str:
+    return f"uv:{user_id}"
+
+
+def bump_user_version(user_id: int) -> None:
+    """Call after any write that changes what the user's cached responses show."""
+    backend = get_backend()
+    if backend is None:
+        return
+    try:
+        backend.incr(_version_key(user_id))
+        _count("invalidations")
+    except Exception as e:
+        _count("errors")
+        log_event("cache_invalidate_error", user_id, {"error": str(e)}, "warning")
+
+
+def get_cached(namespace: str, user_id: int, key: str) -> tuple[Optional[Any], str]:
+    """
+    Returns (value or None, full cache key). Pass the key to set_cached
+    on a miss, so a write racing with the computation is not masked.
+    """
+    backend = get_backend()
+    if backend is None:
+        return None, ""
+    try:
+        version = backend.get_version(_version_key(user_id))
+        full_key = f"{namespace}:{user_id}:{version}:{key}"
+        value = backend.get(full_key)
+    except Exception as e:
+        _count("errors")
+        log_event("cache_get_error", user_id, {"error": str(e)}, "warning")
+        return None, ""
+    _count("hits" if value is not None else "misses")
+    log_stats_periodically("cache_stats", stats)
+    return value, full_key
+
+
+def set_cached(full_key: str, value: Any, ttl: int = CACHE_TTL) -> None:
+    backend = get_backend()
+    if backend is None or not full_key:
+        return
+    try:
+        backend.set(full_key, value, ttl)
+    except Exception as e:
+        _count("errors")
+        log_event("cache_set_error", 0, {"error": str(e)}, "warning")
+
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters of this instance."""
+    with _counters_lock:
+        result: Dict[str, Any] = dict(_counters)
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 3) if lookups else 0.0
+    result["backend"] = CACHE_BACKEND
+    return result
@@ -0,0 +1,154 @@
+# api/compression.py
+# Response compression negotiated from Accept-Encoding.
+#
+#   body, encoding = compress(body, handler.headers.get("Accept-Encoding"))
+#   if encoding: send "Content-Encoding: <encoding>"
+#
+# Brotli ("br") is used when the client accepts it and the optional brotli
+# package is installed, gzip otherwise. Bodies below COMPRESSION_MIN_BYTES
+# are sent as is: the header overhead and CPU are not worth it.
+#
+# Env:
+#   COMPRESSION           "on" (default) / "off"
+#   COMPRESSION_MIN_BYTES minimum body size, default 1024
+#   GZIP_LEVEL            1..9, default 6
+#   BROTLI_QUALITY        0..11, default 5
+#
+# StreamCompressor does the same for chunked bodies (no size threshold:
+# the total is unknown up front, streamed bodies are large anyway).
+#
+# stats() reports bytes before/after per encoding for this instance; it is
+# logged every STATS_LOG_INTERVAL seconds as "compression_stats".
+
+from __future__ import annotations
+
+import gzip
+import os
+import threading
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import brotli  # optional dependency
+except ImportError:
+    brotli = None
+
+from api.logger import log_stats_periodically
+
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION", "on").lower() not in ("0", "off", "false")
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+
+_counters: Dict[str, Dict[str, int]] = {}
+_counters_lock = threading.Lock()
+
+
+def _accepted(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Accept-Encoding -> {coding: q}; q=0 means explicitly refused."""
+    result: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[coding] = q
+    return result
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best supported encoding ("br" / "gzip") or None for identity."""
+    if not COMPRESSION_ENABLED:
+        return None
+    accepted = _accepted(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates = []
+    for coding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        q = accepted.get(coding, wildcard)
+        if q > 0:
+            candidates.append((q, coding))
+    if not candidates:
+        return None
+    # При равных q — первый в списке (br сжимает лучше)
+    return max(candidates, key=lambda c: c[0])[1]
+
+
+def _record(encoding: str, before: int, after: int) -> None:
+    with _counters_lock:
+        entry = _counters.setdefault(encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0})
+        entry["responses"] += 1
+        entry["bytes_in"] += before
+        entry["bytes_out"] += after
+    log_stats_periodically("compression_stats", stats)
+
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Returns (body, encoding); encoding None means the body is unchanged."""
+    encoding = negotiate(accept_encoding)
+    if encoding is None or len(body) < COMPRESSION_MIN_BYTES:
+        _record("identity", len(body), len(body))
+        return body, None
+
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+    _record(encoding, len(body), len(compressed))
+    return compressed, encoding
+
+
+class StreamCompressor:
+    """Incremental compressor; encoding None passes data through (still counted)."""
+
+    def __init__(self, encoding: Optional[str]):
+        self.encoding = encoding
+        self.bytes_in = 0
+        self.bytes_out = 0
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == "gzip":
+            # wbits 16+: gzip header/trailer
+            self._impl = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self._impl = None
+
+    def compress(self, data: bytes) -> bytes:
+        self.bytes_in += len(data)
+        if self._impl is None:
+            out = data
+        elif self.encoding == "br":
+            out = self._impl.process(data)
+        else:
+            out = self._impl.compress(data)
+        self.bytes_out += len(out)
+        return out
+
+    def finish(self) -> bytes:
+        if self._impl is None:
+            out = b""
+        elif self.encoding == "br":
+            out = self._impl.finish()
+        else:
+            out = self._impl.flush()
+        self.bytes_out += len(out)
+        _record(self.encoding or "identity", self.bytes_in, self.bytes_out)
+        return out
+
+
+def stats() -> Dict[str, Any]:
+    """Bytes before/after compression per encoding (this instance)."""
+    with _counters_lock:
+        result: Dict[str, Any] = {k: dict(v) for k, v in _counters.items()}
+    for entry in result.values():
+        entry["ratio"] = round(entry["bytes_out"] / entry["bytes_in"], 3) if entry["bytes_in"] else 1.0
+    result["brotli_available"] = brotli is not None
+    result["min_bytes"] = COMPRESSION_MIN_BYTES
+    return result
@@ -2,9 +2,10 @@ from http.server import BaseHTTPRequestHandler
 from datetime import datetime, timedelta, date
 import calendar
 import os
-import requests
 
+from api.cache import bump_user_version
 from api.db import get_supabase_admin
+from api.notifier import Dispatcher, Notification
 from api.utils import send_ok, send_error
 
 
@@ -19,12 +20,15 @@ def _get_env(name: str) -> str:
 CRON_SECRET = _get_env("CRON_SECRET")
 TG_TOKEN = _get_env("TELEGRAM_TOKEN")
 
-
-def send_telegram(chat_id, text: str) -> None:
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
-    payload = {"chat_id": chat_id, "text": text}
-    # Add timeout to prevent hanging
-    requests.post(url, json=payload, timeout=10)
+REMIND_DAYS_AHEAD = 3
+# Напоминаем о пропущенной оплате не дольше этого; более старые даты
+# сдвигаются молча (первый запуск не должен разослать весь архив)
+REMIND_CATCH_UP_DAYS = 1
+# Сколько устаревших подписок сдвигать за один запуск; остальные в следующий
+STALE_ADVANCE_LIMIT = 200
+# Значения period, для которых _next_date двигает дату (он приводит к lower)
+_PERIODS = ("month", "monthly", "year", "yearly", "week", "weekly", "day", "daily")
+_PERIOD_VALUES = [v for p in _PERIODS for v in (p, p.capitalize(), p.upper())]
 
 
 def _add_months(d: date, months: int) -> date:
@@ -50,7 +54,28 @@ def _next_date(old_date: date, period: str) -> date:
     return old_date
 
 
+def _due_text(due: date, today: date) -> str:
+    days = (due - today).days
+    if days < 0:
+        return f"Прошла дата оплаты ({due:%d.%m.%Y}) подписки"
+    if days == 0:
+        return "Сегодня оплата подписки"
+    if days == 1:
+        return "Завтра оплата подписки"
+    return f"Через {days} {'дня' if days < 5 else 'дней'} оплата подписки"
+
+
 class handler(BaseHTTPRequestHandler):
+    """
+    Daily reminders (vercel.json cron, 10:00 UTC): subscriptions due within
+    REMIND_DAYS_AHEAD days get a message, then next_date moves to the
+    following period. A reminder that is not sent (deadline, Telegram
+    errors) keeps its next_date, so the next day's run picks it up again:
+    rows are selected by a window, not by equality. The window reaches back
+    REMIND_CATCH_UP_DAYS; rows older than that (cron was down, first run)
+    are moved to their next period without a message.
+    """
+
     def do_GET(self):
         # Strict auth: "Authorization: Bearer <CRON_SECRET>"
         auth_header = self.headers.get("Authorization", "")
@@ -61,54 +86,102 @@ class handler(BaseHTTPRequestHandler):
 
         supabase = get_supabase_admin()
 
-        # Find subscriptions with next_date = today + 3 days (UTC)
-        target_date = (datetime.utcnow().date() + timedelta(days=3)).strftime("%Y-%m-%d")
+        # Subscriptions due up to today + 3 days (UTC), including ones
+        # missed within the catch-up window
+        today = datetime.utcnow().date()
+        target = today + timedelta(days=REMIND_DAYS_AHEAD)
+        target_date = target.strftime("%Y-%m-%d")
+        catch_up_date = (today - timedelta(days=REMIND_CATCH_UP_DAYS)).strftime("%Y-%m-%d")
 
         res = (
             supabase.table("subscriptions")
             .select("*")
-            .eq("next_date", target_date)
+            .gte("next_date", catch_up_date)
+            .lte("next_date", target_date)
+            .order("next_date")
             .execute()
         )
         subs = res.data or []
 
-        processed = 0
-        notified = 0
+        # Older rows: no reminder, only move next_date (unknown periods
+        # never move, so they are left out instead of being reselected)
+        stale_res = (
+            supabase.table("subscriptions")
+            .select("*")
+            .lt("next_date", catch_up_date)
+            .in_("period", _PERIOD_VALUES)
+            .order("next_date")
+            .limit(STALE_ADVANCE_LIMIT)
+            .execute()
+        )
+        stale = stale_res.data or []
+
+        def advance(sub: dict) -> None:
+            """Move next_date past the reminder window (runs in dispatcher workers)"""
+            new_d = datetime.strptime(sub["next_date"], "%Y-%m-%d").date()
+            # Пропущенные периоды не напоминаем задним числом
+            while new_d <= target:
+                moved = _next_date(new_d, sub.get("period"))
+                if moved == new_d:
+                    break
+                new_d = moved
+            supabase.table("subscriptions").update(
+                {"next_date": new_d.strftime("%Y-%m-%d")}
+            ).eq("id", sub["id"]).execute()
+            if sub.get("user_id") is not None:
+                bump_user_version(sub["user_id"])
+
+        notifications = []
         errors = 0
-
         for sub in subs:
-            processed += 1
-            try:
-                # 1) Notify
-                name = sub.get("name") or ""
-                amount = sub.get("amount")
-                currency = sub.get("currency") or ""
-                user_id = sub.get("user_id")
-
-                if user_id is not None:
-                    msg = (
-                        "🔔 Напоминание!\n"
-                        f"Через 3 дня оплата подписки: {name}\n"
-                        f"Сумма: {amount} {currency}"
-                    )
-                    send_telegram(user_id, msg)
-                    notified += 1
-
-                # 2) Move next_date forward
-                old = datetime.strptime(sub["next_date"], "%Y-%m-%d").date()
-                new_d = _next_date(old, sub.get("period"))
-
-                supabase.table("subscriptions").update(
-                    {"next_date": new_d.strftime("%Y-%m-%d")}
-                ).eq("id", sub["id"]).execute()
+            due = datetime.strptime(sub["next_date"], "%Y-%m-%d").date()
+            if due < target and _next_date(due, sub.get("period")) == due:
+                # Неизвестный период: дата не двигается, напоминали в её день
+                continue
+            user_id = sub.get("user_id")
+            if user_id is None:
+                # Nobody to notify, just move the date
+                try:
+                    advance(sub)
+                except Exception:
+                    errors += 1
+                continue
+            msg = (
+                "🔔 Напоминание!\n"
+                f"{_due_text(due, today)}: {sub.get('name') or ''}\n"
+                f"Сумма: {sub.get('amount')} {sub.get('currency') or ''}"
+            )
+            notifications.append(Notification(user_id, msg, sub))
+
+        # Concurrent, rate-limited sends; next_date moves once Telegram has
+        # answered for good (delivered, or rejected: chat gone / bot
+        # blocked). Deferred and failed ones keep next_date and are sent by
+        # the next daily run.
+        dispatch = Dispatcher(TG_TOKEN).dispatch(
+            notifications,
+            on_done=lambda n, delivered: advance(n.ref),
+        )
+        errors += dispatch["failed"] + dispatch["callback_errors"]
 
+        # After the reminders, so they get the dispatcher's time budget first
+        for sub in stale:
+            try:
+                advance(sub)
             except Exception:
                 errors += 1
-                # keep going, do not fail whole cron
+
+        # Housekeeping: drop old update_id keys used by bot dedup (api/dedup.py)
+        try:
+            supabase.rpc("prune_processed_updates", {}).execute()
+        except Exception as e:
+            print(f"Prune processed_updates error: {e}")
 
         send_ok(self, {
             "target_date": target_date,
-            "processed": processed,
-            "notified": notified,
+            "processed": len(subs),
+            "stale_advanced": len(stale),
+            "notified": dispatch["sent"],
             "errors": errors,
+            "deferred": dispatch["deferred"],
+            "dispatch": dispatch,
         })
@@ -1,12 +1,33 @@
 # api/db.py
 from __future__ import annotations
 
+import base64
+import hashlib
+import hmac
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
-from typing import Optional
+from typing import Any, Callable, List, Optional
 
 _supabase: Client | None = None
 
+# Per-user scoped clients (JWT mode). Ключ — user_id, значение — (client, exp).
+USER_CLIENT_CACHE_SIZE = int(os.environ.get("SUPABASE_USER_CLIENT_CACHE", "256"))
+USER_TOKEN_TTL_SECONDS = int(os.environ.get("SUPABASE_USER_TOKEN_TTL", "3600"))
+# Перевыпускаем токен заранее, чтобы он не истёк посреди запроса
+_TOKEN_REFRESH_MARGIN = 60
+
+_user_clients: "OrderedDict[int, tuple[Client, float]]" = OrderedDict()
+_user_clients_lock = threading.Lock()
+
+# Общий пул для параллельных независимых запросов (см. run_parallel)
+DB_FANOUT_WORKERS = int(os.environ.get("DB_FANOUT_WORKERS", "8"))
+_executor = ThreadPoolExecutor(max_workers=DB_FANOUT_WORKERS, thread_name_prefix="db-fanout")
+
 
 def _get_env(name: str) -> str:
     value = os.environ.get(name)
@@ -27,18 +48,90 @@ def get_supabase() -> Client:
     return _supabase
 
 
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def sign_user_token(user_id: int, secret: str, ttl: int = USER_TOKEN_TTL_SECONDS) -> tuple[str, float]:
+    """
+    Выпускает HS256 JWT для пользователя (claims: sub, user_id, role).
+    RLS-политики читают user_id из auth.jwt(), см. sql/001_user_jwt_rls.sql.
+
+    Returns:
+        (token, exp) — exp в unix-секундах
+    """
+    now = int(time.time())
+    exp = now + ttl
+    header = {"alg": "HS256", "typ": "JWT"}
+    claims = {
+        "sub": str(user_id),
+        "user_id": user_id,
+        "role": "authenticated",
+        "aud": "authenticated",
+        "iat": now,
+        "exp": exp,
+    }
+    signing_input = (
+        _b64url(json.dumps(header, separators=(",", ":")).encode("utf-8"))
+        + "."
+        + _b64url(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    )
+    signature = hmac.new(secret.encode("utf-8"), signing_input.encode("ascii"), hashlib.sha256).digest()
+    return f"{signing_input}.{_b64url(signature)}", float(exp)
+
+
+def _get_scoped_client(user_id: int, secret: str) -> Client:
+    """
+    Клиент с JWT пользователя в Authorization. Кэшируется (LRU) между
+    тёплыми вызовами; токен перевыпускается незадолго до истечения.
+    """
+    now = time.time()
+    with _user_clients_lock:
+        cached = _user_clients.get(user_id)
+        if cached is not None:
+            client, exp = cached
+            _user_clients.move_to_end(user_id)
+            if exp - _TOKEN_REFRESH_MARGIN > now:
+                return client
+            token, exp = sign_user_token(user_id, secret)
+            client.postgrest.auth(token)
+            _user_clients[user_id] = (client, exp)
+            return client
+
+    url = _get_env("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_ANON_KEY") or _get_env("SUPABASE_KEY")
+    client = create_client(url, key)
+    token, exp = sign_user_token(user_id, secret)
+    client.postgrest.auth(token)
+
+    with _user_clients_lock:
+        _user_clients[user_id] = (client, exp)
+        _user_clients.move_to_end(user_id)
+        while len(_user_clients) > USER_CLIENT_CACHE_SIZE:
+            _user_clients.popitem(last=False)
+    return client
+
+
 def get_supabase_for_user(user_id: int) -> Client:
     """
     Возвращает клиент Supabase с настройкой пользователя для RLS.
     Используй ЭТУ функцию в обычных API endpoints.
+
+    Если задан SUPABASE_JWT_SECRET — отдаёт отдельный клиент пользователя,
+    который передаёт user_id в JWT с каждым запросом (без лишнего RPC).
+    Иначе — старый режим: общий клиент + RPC set_user_context.
     """
+    secret = os.environ.get("SUPABASE_JWT_SECRET")
+    if secret:
+        return _get_scoped_client(user_id, secret)
+
     client = get_supabase()
     set_user_context(client, user_id)
     return client
 
 
 def set_user_context(client: Client, user_id: int) -> None:
-    """Устанавливает текущего пользователя для RLS"""
+    """Устанавливает текущего пользователя для RLS (legacy режим)"""
     try:
         client.rpc('set_user_context', {'p_user_id': user_id}).execute()
     except Exception as e:
@@ -51,3 +144,17 @@ def get_supabase_admin() -> Client:
     Используй ТОЛЬКО для bot.py и cron.py!
     """
     return get_supabase()
+
+
+def run_parallel(*calls: Callable[[], Any]) -> List[Any]:
+    """
+    Выполняет независимые запросы одновременно и возвращает результаты
+    в том же порядке. Время ≈ самый медленный запрос, а не сумма.
+    Исключение любого запроса пробрасывается наружу.
+    """
+    # Вложенный вызов из потока пула выполняем последовательно:
+    # иначе занятый пул может ждать сам себя
+    if threading.current_thread().name.startswith("db-fanout"):
+        return [call() for call in calls]
+    futures = [_executor.submit(call) for call in calls]
+    return [f.result() for f in futures]
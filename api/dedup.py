@@ -0,0 +1,203 @@
+# api/dedup.py
+# Deduplication of Telegram updates by update_id.
+#
+# Telegram redelivers an update when the webhook answers too slowly, which
+# used to insert the same expense twice and bill the same AI question twice.
+#
+#   if not claim(update_id): skip        # atomic, before any work
+#   ...process or enqueue...
+#   mark_done(update_id)                 # or release() if it failed
+#
+# claim() is an atomic insert-or-take of a lease: a redelivery that
+# arrives while the first invocation is still running (or already done)
+# is a duplicate. A claim older than BOT_DEDUP_LEASE_SECONDS belongs to an
+# invocation that crashed or was killed by a timeout and is taken again,
+# so the message is not lost either.
+#
+# Two layers:
+#   1) in-memory LRU (warm instance, no I/O)
+#   2) persistent store shared by instances (BOT_DEDUP_STORE):
+#        "supabase" (default) - table processed_updates (sql/003, sql/010)
+#        "sqlite"             - local file BOT_DEDUP_PATH
+#        "memory"             - LRU only
+# If the persistent store fails, the update is treated as new (fail open).
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from api.logger import log_event
+
+DEDUP_CACHE_SIZE = int(os.environ.get("BOT_DEDUP_CACHE_SIZE", "10000"))
+BOT_DEDUP_STORE = os.environ.get("BOT_DEDUP_STORE", "supabase").lower()
+BOT_DEDUP_PATH = os.environ.get("BOT_DEDUP_PATH", "/tmp/bot_dedup.sqlite3")
+# Дольше самого медленного обработчика (AI, выгрузка), короче повторов Telegram
+DEDUP_LEASE_SECONDS = int(os.environ.get("BOT_DEDUP_LEASE_SECONDS", "180"))
+# Telegram перестаёт повторять доставку намного раньше
+DEDUP_RETENTION_SECONDS = 2 * 24 * 3600
+
+# update_id -> None (done) или время захвата (в обработке)
+_seen: "OrderedDict[int, Optional[float]]" = OrderedDict()
+_seen_lock = threading.Lock()
+
+
+class SQLiteDedupStore:
+    def __init__(self, path: str = BOT_DEDUP_PATH):
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_updates ("
+            "update_id INTEGER PRIMARY KEY, created_at REAL NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'done', claimed_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(processed_updates)")}
+        if "status" not in columns:
+            self._conn.execute("ALTER TABLE processed_updates ADD COLUMN status TEXT NOT NULL DEFAULT 'done'")
+            self._conn.execute("ALTER TABLE processed_updates ADD COLUMN claimed_at REAL NOT NULL DEFAULT 0")
+
+    def claim(self, update_id: int, lease_seconds: int) -> bool:
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO processed_updates (update_id, created_at, status, claimed_at) "
+                "VALUES (?, ?, 'processing', ?) "
+                "ON CONFLICT (update_id) DO UPDATE SET claimed_at = excluded.claimed_at "
+                "WHERE status = 'processing' AND claimed_at < ?",
+                (update_id, now, now, now - lease_seconds),
+            )
+            self._inserts += 1
+            if self._inserts % 1000 == 0:
+                self._conn.execute(
+                    "DELETE FROM processed_updates WHERE created_at < ?",
+                    (now - DEDUP_RETENTION_SECONDS,),
+                )
+            return cur.rowcount > 0
+
+    def mark_done(self, update_id: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE processed_updates SET status = 'done' WHERE update_id = ?", (update_id,)
+            )
+
+    def release(self, update_id: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM processed_updates WHERE update_id = ? AND status = 'processing'", (update_id,)
+            )
+
+
+class SupabaseDedupStore:
+    def __init__(self):
+        from api.db import get_supabase_admin
+        self._supabase = get_supabase_admin()
+
+    def claim(self, update_id: int, lease_seconds: int) -> bool:
+        res = self._supabase.rpc(
+            "claim_processed_update",
+            {"p_update_id": update_id, "p_lease_seconds": lease_seconds},
+        ).execute()
+        return bool(res.data)
+
+    def mark_done(self, update_id: int) -> None:
+        (
+            self._supabase.table("processed_updates")
+            .update({"status": "done"})
+            .eq("update_id", update_id)
+            .execute()
+        )
+
+    def release(self, update_id: int) -> None:
+        (
+            self._supabase.table("processed_updates")
+            .delete()
+            .eq("update_id", update_id)
+            .eq("status", "processing")
+            .execute()
+        )
+
+
+_store = None
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        if BOT_DEDUP_STORE == "sqlite":
+            _store = SQLiteDedupStore()
+        elif BOT_DEDUP_STORE == "supabase":
+            _store = SupabaseDedupStore()
+    return _store
+
+
+def _claim_local(update_id: int, now: float) -> bool:
+    """Same lease rules in the LRU; False if done or freshly claimed here."""
+    with _seen_lock:
+        if update_id in _seen:
+            claimed_at = _seen[update_id]
+            _seen.move_to_end(update_id)
+            if claimed_at is None or now - claimed_at < DEDUP_LEASE_SECONDS:
+                return False
+        _seen[update_id] = now
+        _seen.move_to_end(update_id)
+        while len(_seen) > DEDUP_CACHE_SIZE:
+            _seen.popitem(last=False)
+        return True
+
+
+def claim(update_id) -> bool:
+    """
+    Atomically takes the update for processing. False means a duplicate:
+    already done, or being processed by a claim younger than the lease.
+    """
+    if update_id is None:
+        return True
+
+    if not _claim_local(update_id, time.time()):
+        return False
+
+    try:
+        store = _get_store()
+        if store is not None and not store.claim(update_id, DEDUP_LEASE_SECONDS):
+            return False
+    except Exception as e:
+        log_event("dedup_store_error", 0, {"update_id": update_id, "error": str(e)}, "warning")
+
+    return True
+
+
+def mark_done(update_id) -> None:
+    """Records the update as handled; call after processing / enqueue succeeded."""
+    if update_id is None:
+        return
+
+    with _seen_lock:
+        if update_id in _seen:
+            _seen[update_id] = None
+    try:
+        store = _get_store()
+        if store is not None:
+            store.mark_done(update_id)
+    except Exception as e:
+        log_event("dedup_store_error", 0, {"update_id": update_id, "error": str(e)}, "warning")
+
+
+def release(update_id) -> None:
+    """Drops a claim whose processing failed, so the redelivery is taken at once."""
+    if update_id is None:
+        return
+
+    with _seen_lock:
+        if _seen.get(update_id, 0.0) is not None:
+            _seen.pop(update_id, None)
+    try:
+        store = _get_store()
+        if store is not None:
+            store.release(update_id)
+    except Exception as e:
+        log_event("dedup_store_error", 0, {"update_id": update_id, "error": str(e)}, "warning")
@@ -1,6 +1,7 @@
 from http.server import BaseHTTPRequestHandler
 
 from api.auth import require_user_id
+from api.cache import bump_user_version
 from api.db import get_supabase_for_user  # ИЗМЕНЕНО
 from api.utils import read_json, send_ok, send_error
 
@@ -35,4 +36,5 @@ class handler(BaseHTTPRequestHandler):
             send_error(self, 404, "Record not found")
             return
 
+        bump_user_version(user_id)
         send_ok(self, {"message": "Deleted"})
@@ -0,0 +1,49 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from api.auth import require_user_id
+from api.services import HISTORY_DICT_FIELDS, HISTORY_FIELDS, ServiceError, history_page, parse_expense_filters
+from api.utils import list_payload, send_ok, send_error
+
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class handler(BaseHTTPRequestHandler):
+    """
+    GET /api/history?cursor=...&limit=50
+        &category=...&type=income|expense&from=YYYY-MM-DD&to=YYYY-MM-DD
+        &min_amount=...&max_amount=...
+        &format=columnar&fields=id,amount,category
+
+    Response: {"items": [...] | {"columns", "rows", "dictionaries"}, "next_cursor": "..." | null}
+    """
+
+    def do_GET(self):
+        user_id = require_user_id(self)
+        if user_id is None:
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        params = {k: v[0] for k, v in query.items()}
+
+        try:
+            limit = int(params.get("limit") or DEFAULT_PAGE_SIZE)
+        except ValueError:
+            send_error(self, 400, "limit must be an integer")
+            return
+
+        try:
+            filters = parse_expense_filters(params)
+            result = history_page(user_id, params.get("cursor"), limit, filters)
+        except ServiceError as e:
+            send_error(self, e.status, e.message)
+            return
+
+        try:
+            result["items"] = list_payload(result["items"], params, HISTORY_FIELDS, HISTORY_DICT_FIELDS)
+        except ValueError as e:
+            send_error(self, 400, str(e))
+            return
+
+        send_ok(self, result)
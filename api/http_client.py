@@ -0,0 +1,225 @@
+# api/http_client.py
+# Shared outbound HTTP client for Telegram / OCR / LLM calls:
+# - one pooled keep-alive requests.Session per host
+# - per-host connection limits
+# - consistent default timeouts and retry/backoff
+# - per-host latency and connection-reuse counters (logged every
+#   STATS_LOG_INTERVAL seconds as "http_client_stats")
+# - streamed multipart/form-data bodies for uploads (multipart_stream)
+#
+# Usage:
+#   from api.http_client import post
+#   resp = post("https://api.telegram.org/bot.../sendMessage", json=payload, timeout=10)
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from api.logger import log_stats_periodically
+
+DEFAULT_TIMEOUT = float(os.environ.get("HTTP_DEFAULT_TIMEOUT", "10"))
+DEFAULT_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+DEFAULT_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+
+# Per-host overrides: max keep-alive connections kept in the pool
+HOST_POOL_SIZE = {
+    "api.telegram.org": int(os.environ.get("HTTP_POOL_SIZE_TELEGRAM", "20")),
+}
+
+# Retry only on connection errors and on statuses where the request
+# was not processed. Read timeouts are NOT retried: a slow LLM answer
+# must not be billed twice. POST is retried on 429 only: after a 502/504
+# the upstream may already have sent the message / billed the call.
+RETRY_STATUSES = (429, 502, 503, 504)
+POST_RETRY_STATUSES = (429,)
+# Верхняя граница ожидания между повторами (и для Retry-After): вызов
+# идёт внутри webhook, долго спать там нельзя
+RETRY_MAX_WAIT = float(os.environ.get("HTTP_RETRY_MAX_WAIT", "2"))
+
+# Ключ сессии: host или (host, retries) для вызовов со своей политикой повторов
+_sessions: Dict[Any, requests.Session] = {}
+_adapters: Dict[str, List[HTTPAdapter]] = {}
+_metrics: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+class _Retry(Retry):
+    """urllib3 Retry with method-aware statuses and capped waits."""
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == "POST" and status_code not in POST_RETRY_STATUSES:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_backoff_time(self) -> float:
+        return min(super().get_backoff_time(), RETRY_MAX_WAIT)
+
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_MAX_WAIT)
+
+
+def _make_retry(retries: int) -> Retry:
+    return _Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        backoff_factor=0.3,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def get_session(host: str, retries: Optional[int] = None) -> requests.Session:
+    """
+    Returns the pooled keep-alive session for a host (created on first use).
+    retries overrides DEFAULT_RETRIES (e.g. 0 when the caller retries itself).
+    """
+    key = host if retries is None else (host, retries)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            pool_size = HOST_POOL_SIZE.get(host, DEFAULT_POOL_SIZE)
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=pool_size,
+                pool_block=False,
+                max_retries=_make_retry(DEFAULT_RETRIES if retries is None else retries),
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+            _adapters.setdefault(host, []).append(adapter)
+            _metrics.setdefault(host, {
+                "requests": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+            })
+    return session
+
+
+def _record(host: str, elapsed_ms: float, failed: bool) -> None:
+    with _lock:
+        m = _metrics[host]
+        m["requests"] += 1
+        m["total_ms"] += elapsed_ms
+        if elapsed_ms > m["max_ms"]:
+            m["max_ms"] = elapsed_ms
+        if failed:
+            m["errors"] += 1
+
+
+def request(method: str, url: str, *, timeout: Optional[float] = None, retries: Optional[int] = None,
+            **kwargs: Any) -> requests.Response:
+    """
+    Sends a request through the pooled session of the URL's host.
+    Raises the same exceptions as requests.request.
+    """
+    host = urlsplit(url).hostname or ""
+    session = get_session(host, retries)
+    started = time.perf_counter()
+    failed = True
+    try:
+        response = session.request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+        failed = response.status_code >= 500
+        return response
+    finally:
+        _record(host, (time.perf_counter() - started) * 1000, failed)
+        log_stats_periodically("http_client_stats", stats)
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def multipart_stream(fields: Dict[str, Any], file_field: str, filename: str, file_type: str,
+                     chunks: Iterable[bytes]) -> Tuple[str, Iterator[bytes]]:
+    """
+    multipart/form-data body as a generator: the file part is passed
+    through chunk by chunk, so an upload never holds the whole file.
+    requests sends a generator body with Transfer-Encoding: chunked.
+
+    Returns:
+        (Content-Type header value, body generator)
+    Note: a generator body cannot be replayed; send it with retries=0.
+    """
+    boundary = uuid.uuid4().hex
+
+    def body() -> Iterator[bytes]:
+        for name, value in fields.items():
+            if value is None:
+                continue
+            yield (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            ).encode("utf-8")
+        yield (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f"Content-Type: {file_type}\r\n\r\n"
+        ).encode("utf-8")
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode("ascii")
+
+    return f"multipart/form-data; boundary={boundary}", body()
+
+
+def _pool_counters(adapters: List[HTTPAdapter]) -> tuple[int, int]:
+    """(connections opened, requests sent) from the urllib3 pools of a host's adapters."""
+    opened = 0
+    sent = 0
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += getattr(pool, "num_connections", 0)
+            sent += getattr(pool, "num_requests", 0)
+    return opened, sent
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Per-host counters:
+      requests, errors, avg_ms, max_ms, connections_opened, connections_reused
+    """
+    result: Dict[str, Dict[str, Any]] = {}
+    with _lock:
+        snapshot = {host: dict(m) for host, m in _metrics.items()}
+        adapters = {host: list(items) for host, items in _adapters.items()}
+
+    for host, m in snapshot.items():
+        opened, sent = _pool_counters(adapters[host])
+        count = int(m["requests"])
+        result[host] = {
+            "requests": count,
+            "errors": int(m["errors"]),
+            "avg_ms": round(m["total_ms"] / count, 1) if count else 0.0,
+            "max_ms": round(m["max_ms"], 1),
+            "connections_opened": opened,
+            "connections_reused": max(sent - opened, 0),
+        }
+    return result
@@ -1,6 +1,9 @@
 # api/logger.py
 import logging
 import json
+import os
+import threading
+import time
 from datetime import datetime
 
 # Настройка логирования
@@ -11,6 +14,11 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Как часто процесс пишет свои счётчики (http_client, cache, compression)
+STATS_LOG_INTERVAL = int(os.environ.get("STATS_LOG_INTERVAL", "300"))
+_stats_logged_at = {}
+_stats_lock = threading.Lock()
+
 
 def log_event(event_type: str, user_id: int = 0, details: dict = None, level: str = "info"):
     """
@@ -37,3 +45,21 @@ def log_event(event_type: str, user_id: int = 0, details: dict = None, level: st
         logger.warning(log_message)
     else:
         logger.info(log_message)
+
+
+def log_stats_periodically(event_type: str, collect):
+    """
+    Пишет collect() как событие event_type не чаще раза в STATS_LOG_INTERVAL
+    секунд на процесс. Вызывается на горячем пути, поэтому сбор счётчиков
+    выполняется только когда пора писать.
+    """
+    now = time.monotonic()
+    with _stats_lock:
+        last = _stats_logged_at.setdefault(event_type, now)
+        if now - last < STATS_LOG_INTERVAL:
+            return
+        _stats_logged_at[event_type] = now
+    try:
+        log_event(event_type, 0, collect())
+    except Exception as e:
+        logger.warning("stats collection failed for %s: %s", event_type, e)
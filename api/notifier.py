@@ -0,0 +1,248 @@
+# api/notifier.py
+# Concurrent, rate-aware Telegram sendMessage dispatcher (cron reminders).
+#
+#   dispatcher = Dispatcher(token)
+#   stats = dispatcher.dispatch(notifications, on_done=callback)
+#
+# - bounded worker pool (NOTIFY_WORKERS)
+# - global token bucket: NOTIFY_GLOBAL_RATE messages/s (Telegram allows
+#   ~30, default 25 leaves headroom)
+# - per-chat spacing: NOTIFY_CHAT_INTERVAL seconds (Telegram: ~1 msg/s)
+# - 429: waits parameters.retry_after (whole dispatcher and the chat),
+#   then retries. 5xx / network errors are not retried: the request may
+#   have reached the chat, and a second POST would duplicate the message;
+#   they are reported as failed
+# - deadline (NOTIFY_DEADLINE_SECONDS): what is not sent by then is
+#   reported as deferred, so the serverless time limit is not exceeded
+#
+# on_done(notification, delivered) runs in the worker for final outcomes:
+# delivered, or rejected by Telegram for good (4xx: chat not found, bot
+# blocked). Transient failures and deadline skips do not call it: the
+# caller must leave them selectable for its next run (see api/cron.py).
+#
+# dispatch() returns per-run stats: counts, throughput, send latency.
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from api import http_client
+from api.logger import log_event
+
+NOTIFY_WORKERS = int(os.environ.get("NOTIFY_WORKERS", "8"))
+NOTIFY_GLOBAL_RATE = float(os.environ.get("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_CHAT_INTERVAL = float(os.environ.get("NOTIFY_CHAT_INTERVAL", "1.0"))
+# Попытки при 429 (retry_after); 5xx и сетевые ошибки не повторяются
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "3"))
+NOTIFY_DEADLINE_SECONDS = float(os.environ.get("NOTIFY_DEADLINE_SECONDS", "50"))
+SEND_TIMEOUT = 10
+
+
+class Notification(NamedTuple):
+    chat_id: int
+    text: str
+    # Что угодно для on_done (например, строка подписки)
+    ref: Any = None
+
+
+class TokenBucket:
+    """Thread-safe token bucket with a pause (for retry_after)."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def acquire(self, deadline: float) -> bool:
+        """Blocks until a token is available; False if that is after the deadline."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+def _interleave_by_chat(notifications: List[Notification]) -> List[Notification]:
+    """Spreads messages of one chat apart, so workers rarely wait on the per-chat limit."""
+    by_chat: Dict[int, List[Notification]] = {}
+    for n in notifications:
+        by_chat.setdefault(n.chat_id, []).append(n)
+    return [n for group in zip_longest(*by_chat.values()) for n in group if n is not None]
+
+
+def _retry_after(response) -> float:
+    try:
+        value = response.json().get("parameters", {}).get("retry_after")
+        if value is not None:
+            return float(value)
+    except Exception:
+        pass
+    try:
+        return float(response.headers.get("Retry-After", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class Dispatcher:
+    def __init__(self, token: str, workers: int = NOTIFY_WORKERS, global_rate: float = NOTIFY_GLOBAL_RATE,
+                 chat_interval: float = NOTIFY_CHAT_INTERVAL, max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+                 deadline_seconds: float = NOTIFY_DEADLINE_SECONDS):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.deadline_seconds = deadline_seconds
+        self._bucket = TokenBucket(global_rate)
+        self._chat_next: Dict[int, float] = {}
+        self._chat_sent: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._latencies: List[float] = []
+        self._counters: Dict[str, int] = {}
+
+    def _count(self, name: str, latency_ms: Optional[float] = None) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            if latency_ms is not None:
+                self._latencies.append(latency_ms)
+
+    def _reserve_chat_slot(self, chat_id: int, delay: float = 0.0) -> float:
+        """Monotonic time when this chat may receive the next message."""
+        with self._lock:
+            slot = max(time.monotonic() + delay, self._chat_next.get(chat_id, 0.0))
+            self._chat_next[chat_id] = slot + self.chat_interval
+            return slot
+
+    def _claim_send(self, chat_id: int) -> float:
+        """
+        Final per-chat check right before sending: a wait on the global
+        bucket may have pushed this message next to the chat's following one.
+        Returns how long to sleep first.
+        """
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._chat_sent.get(chat_id, 0.0) + self.chat_interval)
+            self._chat_sent[chat_id] = at
+            return at - now
+
+    def _deliver(self, n: Notification, deadline: float, on_done) -> str:
+        delay = 0.0
+        for attempt in range(1, self.max_attempts + 1):
+            slot = self._reserve_chat_slot(n.chat_id, delay)
+            if slot > deadline:
+                return "deferred"
+            time.sleep(max(0.0, slot - time.monotonic()))
+            if not self._bucket.acquire(deadline):
+                return "deferred"
+            time.sleep(self._claim_send(n.chat_id))
+
+            started = time.perf_counter()
+            try:
+                response = http_client.post(
+                    self.url, json={"chat_id": n.chat_id, "text": n.text},
+                    timeout=SEND_TIMEOUT, retries=0,
+                )
+            except Exception as e:
+                self._count("network_errors")
+                log_event("notify_send_error", 0, {"chat_id": n.chat_id, "attempt": attempt, "error": str(e)}, "warning")
+                return "failed"
+            latency_ms = (time.perf_counter() - started) * 1000
+
+            if response.status_code == 200:
+                self._count("sent", latency_ms)
+                self._settle(n, True, on_done)
+                return "sent"
+            if response.status_code == 429:
+                retry_after = _retry_after(response)
+                self._count("rate_limited")
+                self._bucket.pause(retry_after)
+                delay = retry_after
+                continue
+            if response.status_code >= 500:
+                self._count("server_errors")
+                log_event("notify_send_error", 0, {"chat_id": n.chat_id, "status": response.status_code}, "warning")
+                return "failed"
+
+            # 400/403: чат не найден, бот заблокирован — повтор не поможет
+            self._count("rejected")
+            log_event("notify_rejected", 0, {"chat_id": n.chat_id, "status": response.status_code}, "warning")
+            self._settle(n, False, on_done)
+            return "rejected"
+        return "failed"
+
+    def _settle(self, n: Notification, delivered: bool, on_done) -> None:
+        if on_done is None:
+            return
+        try:
+            on_done(n, delivered)
+        except Exception as e:
+            self._count("callback_errors")
+            log_event("notify_callback_error", 0, {"chat_id": n.chat_id, "error": str(e)}, "error")
+
+    def dispatch(self, notifications: List[Notification],
+                 on_done: Optional[Callable[[Notification, bool], Any]] = None) -> Dict[str, Any]:
+        with self._lock:
+            self._latencies = []
+            self._counters = {}
+            self._chat_next = {}
+            self._chat_sent = {}
+        started = time.monotonic()
+        deadline = started + self.deadline_seconds
+        ordered = _interleave_by_chat(notifications)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="notify") as pool:
+            outcomes = list(pool.map(lambda n: self._deliver(n, deadline, on_done), ordered))
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self._counters)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+        stats = {
+            "total": len(ordered),
+            "sent": outcomes.count("sent"),
+            "rejected": outcomes.count("rejected"),
+            "failed": outcomes.count("failed"),
+            "deferred": outcomes.count("deferred"),
+            "rate_limited": counters.get("rate_limited", 0),
+            "server_errors": counters.get("server_errors", 0),
+            "network_errors": counters.get("network_errors", 0),
+            "callback_errors": counters.get("callback_errors", 0),
+            "elapsed_s": round(elapsed, 2),
+            "throughput_per_s": round(outcomes.count("sent") / elapsed, 2) if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "avg": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(latencies[-1], 1) if latencies else 0.0,
+            },
+        }
+        log_event("notify_dispatch", 0, stats)
+        return stats
@@ -0,0 +1,81 @@
+# api/pagination.py
+# Keyset (cursor) pagination over expenses ordered by (created_at, id) desc.
+#
+# A page is "rows strictly after the last row of the previous page", so a
+# request costs O(page) no matter how deep the user has scrolled (no OFFSET).
+# The cursor is opaque for clients: base64url(JSON [created_at, id]).
+# Decoded values end up inside a PostgREST or=() filter, so decode_cursor
+# accepts only an ISO timestamp and an integer id and re-serializes both.
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([row.get("created_at"), row.get("id")], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    """Returns (created_at, id) or None if the cursor is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        return None
+    if not isinstance(created_at, str) or isinstance(row_id, bool) or not isinstance(row_id, int):
+        return None
+    try:
+        ts = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts.isoformat(), row_id
+
+
+def apply_keyset(query, after: Optional[Tuple[str, int]]):
+    """Orders by (created_at, id) desc and skips rows up to the cursor."""
+    if after is not None:
+        created_at, row_id = after
+        # Кавычки: в timestamp есть ':' и '+', зарезервированные в or=()
+        ts = f'"{created_at}"'
+        query = query.or_(f"created_at.lt.{ts},and(created_at.eq.{ts},id.lt.{row_id})")
+    return query.order("created_at", desc=True, nullsfirst=False).order("id", desc=True)
+
+
+def fetch_page(query, after: Optional[Tuple[str, int]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of rows and the cursor of the next page (None on the last one).
+    The query must select created_at and id. The next page is detected by
+    reading limit + 1 rows, so limit must stay below PostgREST max-rows.
+    """
+    rows = apply_keyset(query, after).limit(limit + 1).execute().data or []
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def iter_rows(make_query, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+    """
+    Streams all rows page by page. make_query() must return a fresh
+    filtered select (builders are single-use).
+
+    Ends on an empty page, not on a short one: PostgREST caps a response at
+    its max-rows (1000 by default), so a page may be shorter than asked
+    without being the last. Keep page_size below that cap anyway.
+    """
+    after = None
+    while True:
+        rows = apply_keyset(make_query(), after).limit(page_size).execute().data or []
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1]
+        if last.get("created_at") is None or last.get("id") is None:
+            # Строки без created_at идут последними; keyset дальше не продвинуть
+            return
+        after = (last["created_at"], last["id"])
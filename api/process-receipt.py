@@ -4,13 +4,13 @@ from __future__ import annotations
 from http.server import BaseHTTPRequestHandler
 import json
 import os
-import requests
 import re
 import base64
 from io import BytesIO
 
+from api import http_client
 from api.auth import require_user_id
-from api.db import get_supabase_for_user
+from api.services import insert_expenses
 from api.utils import read_json, send_ok, send_error
 from api.logger import log_event
 
@@ -21,6 +21,8 @@ EXPENSE_CATEGORIES = {
     "Транспорт": ["uber", "bolt", "taxi", "metro"],
 }
 
+INSERT_CHUNK_SIZE = 100  # позиций чека в одном insert
+
 
 def _compress_image_for_ocr(base64_image: str, max_size_kb: int = 900) -> str | None:
     """
@@ -97,7 +99,7 @@ def _ocr_with_ocr_space(base64_image: str) -> str | None:
         
         log_event("ocr_request", 0, {"service": "ocr.space"})
         
-        response = requests.post(url, data=payload, headers=headers, timeout=30)
+        response = http_client.post(url, data=payload, headers=headers, timeout=30)
         
         if response.status_code != 200:
             log_event("ocr_http_error", 0, {
@@ -182,7 +184,7 @@ def _parse_with_deepseek(ocr_text: str) -> dict | None:
         
         log_event("deepseek_request", 0, {})
         
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        response = http_client.post(url, headers=headers, json=payload, timeout=30)
         
         if response.status_code != 200:
             log_event("deepseek_error", 0, {
@@ -271,8 +273,8 @@ class handler(BaseHTTPRequestHandler):
             send_error(self, 400, "Товары не найдены")
             return
         
-        supabase = get_supabase_for_user(user_id)
-        saved = []
+        rows = []
+        candidates = []
         
         for item in items:
             name = item.get("name", "")
@@ -287,23 +289,31 @@ class handler(BaseHTTPRequestHandler):
             cat = _categorize(name, store)
             desc = f"{name} ({store})" if store else name
             
+            expense_data = {
+                "user_id": user_id,
+                "amount": amount,
+                "category": cat,
+                "description": desc,
+                "type": "expense"
+            }
+            
+            if date:
+                expense_data["created_at"] = date
+            
+            rows.append(expense_data)
+            candidates.append({"name": name, "amount": amount, "category": cat})
+        
+        # Пишем пачками вместо insert на каждую позицию
+        saved = []
+        failed = []
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            chunk = slice(start, start + INSERT_CHUNK_SIZE)
             try:
-                expense_data = {
-                    "user_id": user_id,
-                    "amount": amount,
-                    "category": cat,
-                    "description": desc,
-                    "type": "expense"
-                }
-                
-                if date:
-                    expense_data["created_at"] = date
-                
-                supabase.table("expenses").insert(expense_data).execute()
-                saved.append({"name": name, "amount": amount, "category": cat})
-                
+                insert_expenses(user_id, rows[chunk])
+                saved.extend(candidates[chunk])
             except Exception as e:
-                log_event("save_error", user_id, {"error": str(e)}, "error")
+                log_event("save_error", user_id, {"error": str(e), "chunk_start": start}, "error")
+                failed.extend(candidates[chunk])
         
         if len(saved) == 0:
             send_error(self, 500, "Не удалось сохранить")
@@ -311,8 +321,13 @@ class handler(BaseHTTPRequestHandler):
         
         log_event("receipt_success", user_id, {"saved": len(saved)})
         
+        if failed:
+            log_event("receipt_partial_save", user_id, {"saved": len(saved), "failed": len(failed)}, "warning")
+        
         send_ok(self, {
             "items": saved,
             "total_saved": len(saved),
+            "failed_items": failed,
+            "total_failed": len(failed),
             "store": store
         })
@@ -8,10 +8,13 @@ RATE_LIMITS: Dict[str, list] = {}
 MAX_REQUESTS_PER_MINUTE = 20  # Лимит: 20 запросов в минуту
 
 
-def check_rate_limit(user_id: int) -> tuple[bool, int]:
+def check_rate_limit(user_id: int, cost: int = 1) -> tuple[bool, int]:
     """
     Проверяет, не превышен ли лимит запросов
     
+    cost — вес запроса (например, пачка записей считается как один
+    запрос с весом больше 1)
+    
     Возвращает:
         (разрешено: bool, осталось запросов: int)
     """
@@ -28,11 +31,11 @@ def check_rate_limit(user_id: int) -> tuple[bool, int]:
     
     # Проверяем лимит
     current_count = len(RATE_LIMITS[key])
-    if current_count >= MAX_REQUESTS_PER_MINUTE:
+    if current_count + cost > MAX_REQUESTS_PER_MINUTE:
         return False, 0
     
     # Записываем этот запрос
-    RATE_LIMITS[key].append(now)
-    remaining = MAX_REQUESTS_PER_MINUTE - current_count - 1
+    RATE_LIMITS[key].extend([now] * cost)
+    remaining = MAX_REQUESTS_PER_MINUTE - current_count - cost
     
     return True, remaining
@@ -0,0 +1,368 @@
+# api/reports.py
+# Financial report (export) built as a stream:
+#   - header: currency, totals from the rollup aggregate (expense_stats),
+#     subscriptions — a few small queries, no pass over the history
+#   - operations: keyset-paginated reads (api/pagination.iter_rows), one
+#     page in memory at a time
+#   - one row source (iter_operations: typed Operation tuples) and
+#     renderers per format (FORMATS: csv, jsonl, xlsx), all generators of
+#     encoded chunks, so the HTTP handler can write them as they arrive
+#     (utils.send_stream)
+#
+# Memory stays ~one page no matter how long the history is.
+#
+# Modes (parse_export_params):
+#   full         - everything, all-time totals, subscriptions
+#   from/to      - operations in the date range, totals of the range
+#   since=<mark> - only operations created/changed after the watermark of a
+#                  previous export (expenses.updated_at, sql/009); no totals
+#                  or subscriptions, rows carry their ID for matching
+# Every report carries a new watermark (export start minus a small
+# overlap, so rows committed during the previous export are not lost;
+# they may repeat and are matched by ID). Deletions are not reported.
+
+from __future__ import annotations
+
+import csv
+import io
+import itertools
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from api.analytics import summarize, to_number
+from api.db import run_parallel
+from api.pagination import iter_rows
+from api.services import ServiceError, apply_expense_filters, fetch_stats_aggregate, parse_expense_filters
+from api.xlsx import iter_xlsx
+
+EXPORT_COLUMNS = "id, created_at, type, category, amount, description"
+# Well below PostgREST max-rows (1000 by default)
+EXPORT_PAGE_SIZE = 500
+WATERMARK_OVERLAP_SECONDS = 60
+
+PERIOD_NAMES = {
+    "month": "Месяц", "monthly": "Месяц",
+    "year": "Год", "yearly": "Год",
+    "week": "Неделя", "weekly": "Неделя",
+    "day": "День", "daily": "День",
+}
+
+
+class ReportHeader(NamedTuple):
+    currency: str
+    # None in incremental mode
+    income: Optional[float]
+    expense: Optional[float]
+    balance: Optional[float]
+    subscriptions: List[Dict[str, Any]]
+    watermark: str
+    period: Optional[str] = None
+    incremental: bool = False
+
+
+class Operation(NamedTuple):
+    id: Any
+    created_at: str
+    date: Optional[date]
+    type: str  # "income" | "expense"
+    category: str
+    amount: float
+    description: str
+
+
+def parse_export_params(params: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """
+    from/to (YYYY-MM-DD, inclusive) and since (watermark of a previous
+    export, ISO timestamp). Raises ServiceError(400) on bad values.
+    """
+    dates = parse_expense_filters({"from": params.get("from"), "to": params.get("to")})
+    export_format = (params.get("format") or "csv").lower()
+    if export_format not in FORMATS:
+        raise ServiceError(400, f"format must be one of: {', '.join(FORMATS)}")
+
+    since = params.get("since") or None
+    if since is not None:
+        try:
+            # '+' из незакодированного query string приходит пробелом
+            parsed = datetime.fromisoformat(since.strip().replace(" ", "+").replace("Z", "+00:00"))
+        except ValueError:
+            raise ServiceError(400, "since must be the watermark of a previous export (ISO timestamp)")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        since = parsed.astimezone(timezone.utc).isoformat()
+    return {"from": dates["from"], "to": dates["to"], "since": since, "format": export_format}
+
+
+def new_watermark(now: Optional[datetime] = None) -> str:
+    """Watermark for the next incremental export; take it before reading."""
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _range_totals(supabase, user_id: int, date_from: Optional[datetime], date_to: Optional[datetime]) -> Dict[str, float]:
+    """Income/expense of the range from the daily rollups (expense_stats_multi)."""
+    res = supabase.rpc("expense_stats_multi", {
+        "p_user_id": user_id,
+        "p_ranges": [{
+            "key": "export",
+            "from": date_from.date().isoformat() if date_from else None,
+            "to": (date_to + timedelta(days=1)).date().isoformat() if date_to else None,
+        }],
+    }).execute()
+    summary = summarize(res.data or [])
+    return {"income": summary.income, "expense": summary.expense, "total_balance": summary.balance}
+
+
+def _period_label(date_from: Optional[datetime], date_to: Optional[datetime]) -> Optional[str]:
+    if not date_from and not date_to:
+        return None
+    left = date_from.date().isoformat() if date_from else "…"
+    right = date_to.date().isoformat() if date_to else "…"
+    return f"{left} — {right}"
+
+
+def load_header(supabase, user_id: int, options: Optional[Dict[str, Any]] = None) -> ReportHeader:
+    """Currency, totals (rollups) and subscriptions, in parallel."""
+    options = options or {}
+    watermark = new_watermark()
+    date_from, date_to = options.get("from"), options.get("to")
+
+    def currency_call():
+        return (
+            supabase.table("user_settings")
+            .select("currency")
+            .eq("user_id", user_id)
+            .execute()
+        )
+
+    if options.get("since"):
+        settings_res = currency_call()
+        settings = settings_res.data or []
+        return ReportHeader(
+            currency=settings[0].get("currency") if settings else "RUB",
+            income=None, expense=None, balance=None, subscriptions=[],
+            watermark=watermark,
+            period=_period_label(date_from, date_to),
+            incremental=True,
+        )
+
+    if date_from or date_to:
+        totals, settings_res = run_parallel(
+            lambda: _range_totals(supabase, user_id, date_from, date_to),
+            currency_call,
+        )
+        subscriptions: List[Dict[str, Any]] = []
+    else:
+        totals, subs_res, settings_res = run_parallel(
+            lambda: fetch_stats_aggregate(supabase, user_id, None),
+            lambda: (
+                supabase.table("subscriptions")
+                .select("name, amount, period, next_date")
+                .eq("user_id", user_id)
+                .execute()
+            ),
+            currency_call,
+        )
+        subscriptions = subs_res.data or []
+
+    settings = settings_res.data or []
+    return ReportHeader(
+        currency=settings[0].get("currency") if settings else "RUB",
+        income=totals["income"],
+        expense=totals["expense"],
+        balance=totals["total_balance"],
+        subscriptions=subscriptions,
+        watermark=watermark,
+        period=_period_label(date_from, date_to),
+    )
+
+
+def iter_expense_pages(supabase, user_id: int, options: Optional[Dict[str, Any]] = None,
+                       page_size: int = EXPORT_PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Operations newest first, one page (list of rows) at a time."""
+    options = options or {}
+
+    def make_query():
+        query = supabase.table("expenses").select(EXPORT_COLUMNS).eq("user_id", user_id)
+        query = apply_expense_filters(query, {"from": options.get("from"), "to": options.get("to")})
+        if options.get("since"):
+            query = query.gt("updated_at", options["since"])
+        return query
+
+    page: List[Dict[str, Any]] = []
+    rows = iter_rows(make_query, page_size=page_size)
+    for row in rows:
+        page.append(row)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _parse_day(created_at: str) -> Optional[date]:
+    try:
+        return date.fromisoformat(created_at[:10])
+    except ValueError:
+        return None
+
+
+def iter_operations(pages: Iterable[List[Dict[str, Any]]]) -> Iterator[List[Operation]]:
+    """DB pages -> pages of typed operations (the row source of every format)."""
+    for page in pages:
+        batch = []
+        for item in page:
+            created_at = str(item.get("created_at") or "")
+            batch.append(Operation(
+                item.get("id"),
+                created_at,
+                _parse_day(created_at),
+                "income" if item.get("type") == "income" else "expense",
+                item.get("category") or "",
+                to_number(item.get("amount")),
+                item.get("description") or "",
+            ))
+        yield batch
+
+
+def _summary_lines(header: ReportHeader) -> List[List[Any]]:
+    """Summary and subscriptions block (CSV top, XLSX first sheet)."""
+    lines: List[List[Any]] = [["ОТЧЕТ О ФИНАНСАХ", f"Валюта: {header.currency}"]]
+    if header.period:
+        lines.append(["Период", header.period])
+    if header.incremental:
+        lines.append(["Изменения после прошлой выгрузки"])
+    else:
+        lines.append(["Общий Доход", header.income])
+        lines.append(["Общий Расход", header.expense])
+        lines.append(["ТЕКУЩИЙ БАЛАНС" if not header.period else "Баланс за период", header.balance])
+    lines.append(["Метка выгрузки", header.watermark])
+    if header.subscriptions:
+        lines.append([])
+        lines.append(["АКТИВНЫЕ ПОДПИСКИ"])
+        lines.append(["Название", "Сумма", "Период", "След. оплата"])
+        for s in header.subscriptions:
+            period = s.get("period") or ""
+            lines.append([
+                s.get("name") or "",
+                to_number(s.get("amount")),
+                PERIOD_NAMES.get(period.lower(), period),
+                s.get("next_date") or "",
+            ])
+    return lines
+
+
+def _operation_columns(header: ReportHeader) -> List[str]:
+    columns = ["Дата", "Тип", "Категория", "Сумма", "Описание"]
+    return columns + ["ID"] if header.incremental else columns
+
+
+def _operation_row(op: Operation, with_id: bool, day: Any) -> List[Any]:
+    row = [day, "Доход" if op.type == "income" else "Расход", op.category, op.amount, op.description]
+    if with_id:
+        row.append(op.id)
+    return row
+
+
+class _CsvEncoder:
+    """csv.writer over a reusable buffer: rows in, encoded bytes out."""
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, delimiter=";")
+
+    def encode(self, rows: Iterable[List[Any]]) -> bytes:
+        self._writer.writerows(rows)
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data.encode("utf-8")
+
+
+def iter_csv(header: ReportHeader, pages: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """The report as CSV (';', UTF-8 with BOM for Excel), chunk per page."""
+    encoder = _CsvEncoder()
+    lines = _summary_lines(header)
+    lines.append([])
+    lines.append(["ИСТОРИЯ ОПЕРАЦИЙ"])
+    lines.append(_operation_columns(header))
+
+    yield "\ufeff".encode("utf-8") + encoder.encode(lines)
+
+    for batch in iter_operations(pages):
+        yield encoder.encode(
+            _operation_row(op, header.incremental, op.date.isoformat() if op.date else op.created_at[:10])
+            for op in batch
+        )
+
+
+def iter_jsonl(header: ReportHeader, pages: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """
+    One JSON object per line: {"kind": "summary"}, {"kind": "subscription"}*,
+    then {"kind": "operation"} rows with numeric amounts and ISO timestamps.
+    """
+    head = [{
+        "kind": "summary",
+        "currency": header.currency,
+        "income": header.income,
+        "expense": header.expense,
+        "balance": header.balance,
+        "period": header.period,
+        "incremental": header.incremental,
+        "watermark": header.watermark,
+    }]
+    for s in header.subscriptions:
+        head.append({
+            "kind": "subscription",
+            "name": s.get("name") or "",
+            "amount": to_number(s.get("amount")),
+            "period": s.get("period") or "",
+            "next_date": s.get("next_date"),
+        })
+    yield "".join(json.dumps(obj, ensure_ascii=False) + "\n" for obj in head).encode("utf-8")
+
+    for batch in iter_operations(pages):
+        yield "".join(
+            json.dumps({
+                "kind": "operation",
+                "id": op.id,
+                "created_at": op.created_at,
+                "date": op.date.isoformat() if op.date else None,
+                "type": op.type,
+                "category": op.category,
+                "amount": op.amount,
+                "description": op.description,
+            }, ensure_ascii=False) + "\n"
+            for op in batch
+        ).encode("utf-8")
+
+
+def iter_xlsx_report(header: ReportHeader, pages: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """Two sheets: summary (+subscriptions) and operations with real dates/numbers."""
+    operations = (
+        [_operation_row(op, header.incremental, op.date) for op in batch]
+        for batch in iter_operations(pages)
+    )
+    return iter_xlsx([
+        ("Сводка", [_summary_lines(header)]),
+        ("Операции", itertools.chain([[_operation_columns(header)]], operations)),
+    ])
+
+
+class ExportFormat(NamedTuple):
+    render: Callable[[ReportHeader, Iterable[List[Dict[str, Any]]]], Iterator[bytes]]
+    content_type: str
+    extension: str
+    # xlsx уже zip — повторное сжатие только тратит CPU
+    compressible: bool = True
+
+
+FORMATS = {
+    "csv": ExportFormat(iter_csv, "text/csv; charset=utf-8", "csv"),
+    "jsonl": ExportFormat(iter_jsonl, "application/x-ndjson; charset=utf-8", "jsonl"),
+    "xlsx": ExportFormat(
+        iter_xlsx_report, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx",
+        compressible=False,
+    ),
+}
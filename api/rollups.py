@@ -0,0 +1,28 @@
+# api/rollups.py
+# Per-user rollups of expenses by (day | month, type, category).
+#
+# The tables are kept current by statement-level triggers on expenses
+# (sql/005_expense_rollups.sql), so every writer updates them. This module
+# is the rebuild command for when they need to be regenerated:
+#
+#   python -m api.rollups            # all users
+#   python -m api.rollups 123456     # one user
+
+from __future__ import annotations
+
+import sys
+from typing import Optional
+
+from api.db import get_supabase_admin
+from api.logger import log_event
+
+
+def rebuild(user_id: Optional[int] = None) -> None:
+    """Regenerates daily and monthly rollups from the expenses table."""
+    supabase = get_supabase_admin()
+    supabase.rpc("rebuild_expense_rollups", {"p_user_id": user_id}).execute()
+    log_event("rollups_rebuilt", user_id or 0, {"scope": "user" if user_id else "all"})
+
+
+if __name__ == "__main__":
+    rebuild(int(sys.argv[1]) if len(sys.argv) > 1 else None)
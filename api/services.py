@@ -0,0 +1,708 @@
+# api/services.py
+# In-process business logic shared by the HTTP handlers and the bot:
+# - create_expense  (POST /api/index)
+# - create_expenses (POST /api/index with "entries")
+# - build_expense / insert_expenses (bulk writes: bot batches)
+# - compute_stats   (GET /api/stats), get_stats adds the per-user cache
+# - compute_multi_stats (GET /api/stats?periods=...)
+# - ask_assistant   (POST /api/ai-assistant)
+# - history_page    (GET /api/history)
+# - compute_timeseries (GET /api/timeseries)
+#
+# Functions return plain dicts (the "data" part of the API response) and
+# raise ServiceError(status, message) on validation / DB errors; HTTP
+# handlers turn it into send_error, the bot into a chat message.
+
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from api import cache
+from api.analytics import summarize, to_number
+from api.assistant import chat_with_ai, get_chat_history, get_financial_context, save_chat_message
+from api.db import get_supabase_for_user, run_parallel
+from api.pagination import decode_cursor, fetch_page
+from api.logger import log_event
+
+
+HISTORY_LIMIT = 20
+HISTORY_PAGE_MAX = 200
+TIMESERIES_BUCKETS = ("day", "week", "month")
+MAX_TIMESERIES_POINTS = 732
+HISTORY_COLUMNS = "id, created_at, amount, category, description, type"
+HISTORY_FIELDS = tuple(c.strip() for c in HISTORY_COLUMNS.split(","))
+# Повторяющиеся строки — кандидаты на словарное кодирование (format=columnar)
+HISTORY_DICT_FIELDS = ("category", "type")
+MAX_BATCH_ENTRIES = 200
+STATS_PERIODS = ("all", "day", "week", "month")
+
+
+class ServiceError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# ---------- expenses ----------
+
+def _extract_amount(text: str):
+    digits = "".join(ch for ch in text if ch.isdigit())
+    if not digits:
+        return None
+    try:
+        amt = int(digits)
+        if amt < 0 or amt > 10_000_000:
+            return None
+        return amt
+    except Exception:
+        return None
+
+
+def _is_iso_date(value: str) -> bool:
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except Exception:
+        return False
+
+
+def _db_result_has_error(res) -> bool:
+    """
+    Попытка универсально определить, содержит ли результат ошибки.
+    Поддерживает разные формы ответа клиентов supabase.
+    """
+    try:
+        if res is None:
+            return True
+        # dict-like
+        if isinstance(res, dict):
+            if res.get("error") or res.get("status_code", 0) >= 400:
+                return True
+        # object-like
+        if hasattr(res, "error") and getattr(res, "error"):
+            return True
+        if hasattr(res, "status_code") and getattr(res, "status_code") >= 400:
+            return True
+    except Exception:
+        return True
+    return False
+
+
+def build_expense(user_id: int, text: Any, record_type: Optional[str] = None, date: Any = None) -> Dict[str, Any]:
+    """
+    Разбирает текст вида "500 такси" в строку для таблицы expenses
+    (сумма, категория, тип, дата). Ничего не пишет в БД.
+    """
+    if not isinstance(text, str):
+        raise ServiceError(400, "text must be a string")
+
+    text_lc = text.lower()
+
+    amount = _extract_amount(text_lc)
+    if amount is None:
+        raise ServiceError(400, "Amount not found")
+
+    category = "Разное"
+    resolved_type = "expense"
+
+    if record_type == "income":
+        resolved_type = "income"
+        category = "Доход"
+    else:
+        if any(w in text_lc for w in ["зарплата", "зп", "аванс"]):
+            resolved_type = "income"
+            category = "Доход"
+        elif "еда" in text_lc:
+            category = "Еда"
+        elif "такси" in text_lc:
+            category = "Транспорт"
+
+    data = {
+        "user_id": user_id,
+        "amount": amount,
+        "category": category,
+        "description": text.strip() if text else "Запись",
+        "type": resolved_type,
+    }
+
+    if date is not None:
+        if not isinstance(date, str) or not _is_iso_date(date.strip()):
+            raise ServiceError(400, "date must be in YYYY-MM-DD format")
+        data["created_at"] = date.strip()
+
+    return data
+
+
+def insert_expenses(user_id: int, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Записывает строки одним bulk insert.
+
+    Returns:
+        вставленные строки (res.data)
+    """
+    # Используем RLS-клиент
+    supabase = get_supabase_for_user(user_id)
+    try:
+        res = supabase.table("expenses").insert(rows).execute()
+        if not res.data:
+            log_event("expense_create_failed", user_id, {"error": "Empty response", "count": len(rows)})
+            raise ServiceError(500, "Failed to save expense")
+
+    except ServiceError:
+        raise
+    except Exception as e:
+        # Логируем неудачную попытку создания записи и возвращаем 500
+        log_event("expense_create_failed", user_id, {"error": str(e), "data": rows[:5], "count": len(rows)})
+        raise ServiceError(500, "Failed to save expense")
+
+    # Некоторые клиенты не бросают исключение, но возвращают объект/словарь с ошибкой
+    if _db_result_has_error(res):
+        log_event("expense_create_failed", user_id, {"db_result": str(res), "data": rows[:5], "count": len(rows)})
+        raise ServiceError(500, "Failed to save expense")
+
+    cache.bump_user_version(user_id)
+    return res.data
+
+
+def create_expense(user_id: int, text: Any, record_type: Optional[str] = None, date: Any = None) -> Dict[str, Any]:
+    """
+    Создаёт запись расхода/дохода из текста вида "500 такси".
+
+    Returns:
+        {"message", "category", "type", "amount"}
+    """
+    data = build_expense(user_id, text, record_type=record_type, date=date)
+    insert_expenses(user_id, [data])
+
+    # Логируем успешное создание записи
+    log_event("expense_created", user_id, {
+        "amount": data["amount"],
+        "category": data["category"],
+        "type": data["type"]
+    })
+
+    return {"message": "Saved", "category": data["category"], "type": data["type"], "amount": data["amount"]}
+
+
+def create_expenses(user_id: int, entries: Any) -> Dict[str, Any]:
+    """
+    Пачка записей: каждая {"text", "type"?, "date"?} проверяется по тем же
+    правилам, что и create_expense; все валидные пишутся одним insert.
+
+    Returns:
+        {"results": [{"index", "ok", ...}], "saved", "failed"}
+    """
+    if not isinstance(entries, list) or not entries:
+        raise ServiceError(400, "entries must be a non-empty array")
+    if len(entries) > MAX_BATCH_ENTRIES:
+        raise ServiceError(400, f"Too many entries (max {MAX_BATCH_ENTRIES})")
+
+    results: List[Dict[str, Any]] = []
+    rows: List[Dict[str, Any]] = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            results.append({"index": i, "ok": False, "error": "entry must be an object"})
+            continue
+        try:
+            row = build_expense(user_id, entry.get("text", ""), record_type=entry.get("type"), date=entry.get("date"))
+        except ServiceError as e:
+            results.append({"index": i, "ok": False, "error": e.message})
+            continue
+        rows.append(row)
+        results.append({"index": i, "ok": True, "category": row["category"], "type": row["type"], "amount": row["amount"]})
+
+    if rows:
+        insert_expenses(user_id, rows)
+        log_event("expenses_created", user_id, {"count": len(rows)})
+
+    return {"results": results, "saved": len(rows), "failed": len(results) - len(rows)}
+
+
+# ---------- stats ----------
+
+def period_start(period: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Начало периода (UTC, naive) или None для "all"."""
+    now = now or datetime.utcnow()
+    if period == "day":
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        # Aligned to midnight: rollups are per UTC day
+        return (now - timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "month":
+        return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return None
+
+
+def _utc_iso(value: datetime) -> str:
+    return value.isoformat() + "+00:00"
+
+
+def fetch_stats_aggregate(supabase, user_id: int, since: Optional[datetime]) -> Dict[str, Any]:
+    """
+    Агрегаты считает БД по свёрткам (sql/005_expense_rollups.sql): баланс
+    по всей истории, доход/расход за период и расходы по категориям.
+    """
+    res = supabase.rpc("expense_stats", {
+        "p_user_id": user_id,
+        "p_since": _utc_iso(since) if since else None,
+    }).execute()
+    data = res.data or {}
+    return {
+        "total_balance": to_number(data.get("total_balance")),
+        "income": to_number(data.get("income")),
+        "expense": to_number(data.get("expense")),
+        "categories": [
+            (c.get("category") or "Other", to_number(c.get("amount")))
+            for c in (data.get("categories") or [])
+        ],
+    }
+
+
+def _load_currency(supabase, user_id: int) -> str:
+    res = (
+        supabase.table("user_settings")
+        .select("currency")
+        .eq("user_id", user_id)
+        .execute()
+    )
+    return res.data[0].get("currency") if res.data else "RUB"
+
+
+def _load_history(supabase, user_id: int, since: Optional[datetime]) -> List[Dict[str, Any]]:
+    # Only the rows the UI shows
+    query = (
+        supabase.table("expenses")
+        .select(HISTORY_COLUMNS)
+        .eq("user_id", user_id)
+    )
+    if since:
+        query = query.gte("created_at", _utc_iso(since))
+    return query.order("created_at", desc=True).limit(HISTORY_LIMIT).execute().data or []
+
+
+def _load_subscriptions(supabase, user_id: int) -> List[Dict[str, Any]]:
+    res = (
+        supabase.table("subscriptions")
+        .select("*")
+        .eq("user_id", user_id)
+        .order("next_date")
+        .execute()
+    )
+    return res.data or []
+
+
+def compute_stats(user_id: int, period: str = "all") -> Dict[str, Any]:
+    """
+    Баланс, доходы/расходы за период, разбивка по категориям, история
+    и подписки — то, что отдаёт GET /api/stats.
+    """
+    if period not in STATS_PERIODS:
+        raise ServiceError(400, "Invalid period")
+
+    supabase = get_supabase_for_user(user_id)
+    start_date = period_start(period)
+
+    def load_totals():
+        try:
+            return fetch_stats_aggregate(supabase, user_id, start_date)
+        except Exception as e:
+            log_event("stats_aggregate_failed", user_id, {"error": str(e)}, "error")
+            raise ServiceError(500, "Failed to load stats")
+
+    # Independent reads run concurrently: latency ≈ the slowest one
+    currency, totals, history, subs_data = run_parallel(
+        lambda: _load_currency(supabase, user_id),
+        load_totals,
+        lambda: _load_history(supabase, user_id, start_date),
+        lambda: _load_subscriptions(supabase, user_id),
+    )
+
+    # Categories come sorted by spend desc
+    labels = [k for k, _ in totals["categories"]]
+    values = [v for _, v in totals["categories"]]
+
+    return {
+        "currency": currency,
+        "total_balance": totals["total_balance"],
+        "period": {"income": totals["income"], "expense": totals["expense"]},
+        "chart": {"labels": labels, "data": values},
+        "history": history,
+        "subscriptions": subs_data,
+    }
+
+
+# ---------- multi-period stats ----------
+
+def period_range(period: str, today: date) -> tuple[Optional[date], Optional[date]]:
+    """[from, to) по дням (UTC) для day|week|month|all; None — без границы."""
+    start = period_start(period, datetime(today.year, today.month, today.day))
+    return (start.date() if start else None), None
+
+
+def previous_range(period: str, date_from: Optional[date], date_to: Optional[date],
+                   today: date) -> Optional[tuple[date, date]]:
+    """Предыдущий период той же длины, [from, to). Для "all" — None."""
+    if date_from is None:
+        return None
+    if period == "month":
+        prev_start = (date_from - timedelta(days=1)).replace(day=1)
+        return prev_start, date_from
+    end = date_to or (today + timedelta(days=1))
+    length = end - date_from
+    return date_from - length, date_from
+
+
+def _summarize_range(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    summary = summarize(rows)
+    sorted_items = summary.sorted_categories()
+    return {
+        "income": summary.income,
+        "expense": summary.expense,
+        "chart": {"labels": [k for k, _ in sorted_items], "data": [v for _, v in sorted_items]},
+    }
+
+
+def compute_multi_stats(user_id: int, periods: List[str], custom: Optional[tuple[date, date]] = None,
+                        compare: bool = False) -> Dict[str, Any]:
+    """
+    Несколько периодов (и custom from/to) одним запросом: все диапазоны,
+    включая "предыдущие" для сравнения, считаются одним проходом по дневным
+    свёрткам (expense_stats_multi, sql/008_expense_stats_multi.sql).
+
+    Returns:
+        {"currency", "total_balance", "periods": {key: {"from", "to", "income",
+         "expense", "chart", "history"?, "previous"?}}, "subscriptions"}
+    """
+    for period in periods:
+        if period not in STATS_PERIODS:
+            raise ServiceError(400, "Invalid period")
+    if not periods and custom is None:
+        raise ServiceError(400, "No periods requested")
+    if custom is not None and custom[0] > custom[1]:
+        raise ServiceError(400, "from must not be after to")
+
+    today = datetime.utcnow().date()
+
+    # key -> (from, to) inclusive/exclusive dates
+    ranges: Dict[str, tuple[Optional[date], Optional[date]]] = {}
+    for period in periods:
+        ranges[period] = period_range(period, today)
+    if custom is not None:
+        ranges["custom"] = (custom[0], custom[1] + timedelta(days=1))
+    if compare:
+        for key, (date_from, date_to) in list(ranges.items()):
+            prev = previous_range(key, date_from, date_to, today)
+            if prev is not None:
+                ranges[f"{key}:previous"] = prev
+    # Баланс — по всей истории
+    ranges["__total__"] = (None, None)
+
+    supabase = get_supabase_for_user(user_id)
+
+    def load_ranges():
+        try:
+            res = supabase.rpc("expense_stats_multi", {
+                "p_user_id": user_id,
+                "p_ranges": [
+                    {
+                        "key": key,
+                        "from": date_from.isoformat() if date_from else None,
+                        "to": date_to.isoformat() if date_to else None,
+                    }
+                    for key, (date_from, date_to) in ranges.items()
+                ],
+            }).execute()
+        except Exception as e:
+            log_event("stats_aggregate_failed", user_id, {"error": str(e)}, "error")
+            raise ServiceError(500, "Failed to load stats")
+        return res.data or []
+
+    currency, rows, history, subs_data = run_parallel(
+        lambda: _load_currency(supabase, user_id),
+        load_ranges,
+        # Все стандартные периоды заканчиваются "сейчас", поэтому их история —
+        # это последние HISTORY_LIMIT записей, отфильтрованные по началу периода
+        lambda: _load_history(supabase, user_id, None),
+        lambda: _load_subscriptions(supabase, user_id),
+    )
+
+    rows_by_key: Dict[str, List[Dict[str, Any]]] = {key: [] for key in ranges}
+    for row in rows:
+        rows_by_key.setdefault(row.get("key"), []).append(row)
+
+    total = _summarize_range(rows_by_key["__total__"])
+
+    result_periods: Dict[str, Any] = {}
+    for key in list(periods) + (["custom"] if custom is not None else []):
+        date_from, date_to = ranges[key]
+        entry = _summarize_range(rows_by_key[key])
+        entry["from"] = date_from.isoformat() if date_from else None
+        entry["to"] = (date_to - timedelta(days=1)).isoformat() if date_to else today.isoformat()
+        if key != "custom":
+            since = date_from.isoformat() if date_from else None
+            entry["history"] = [
+                item for item in history
+                if since is None or not item.get("created_at") or str(item["created_at"])[:10] >= since
+            ]
+        prev_key = f"{key}:previous"
+        if prev_key in ranges:
+            prev_from, prev_to = ranges[prev_key]
+            previous = _summarize_range(rows_by_key[prev_key])
+            previous["from"] = prev_from.isoformat()
+            previous["to"] = (prev_to - timedelta(days=1)).isoformat()
+            entry["previous"] = previous
+        result_periods[key] = entry
+
+    return {
+        "currency": currency,
+        "total_balance": total["income"] - total["expense"],
+        "periods": result_periods,
+        "subscriptions": subs_data,
+    }
+
+
+def get_stats(user_id: int, period: str = "all") -> tuple[Dict[str, Any], bool]:
+    """
+    compute_stats через кэш (api/cache.py).
+
+    Returns:
+        (data, cache_hit)
+    """
+    if period not in STATS_PERIODS:
+        raise ServiceError(400, "Invalid period")
+
+    cached, cache_key = cache.get_cached("stats", user_id, period)
+    if cached is not None:
+        return cached, True
+
+    data = compute_stats(user_id, period)
+    cache.set_cached(cache_key, data)
+    return data, False
+
+
+def get_multi_stats(user_id: int, periods: List[str], custom: Optional[tuple[date, date]] = None,
+                    compare: bool = False) -> tuple[Dict[str, Any], bool]:
+    """compute_multi_stats через кэш. Returns (data, cache_hit)."""
+    key = "multi:{}:{}:{}".format(
+        ",".join(periods),
+        f"{custom[0].isoformat()}..{custom[1].isoformat()}" if custom else "",
+        int(compare),
+    )
+    cached, cache_key = cache.get_cached("stats", user_id, key)
+    if cached is not None:
+        return cached, True
+
+    data = compute_multi_stats(user_id, periods, custom, compare)
+    cache.set_cached(cache_key, data)
+    return data, False
+
+
+# ---------- history ----------
+
+def _parse_date_param(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None or value == "":
+        return None
+    if not _is_iso_date(value):
+        raise ServiceError(400, f"{name} must be in YYYY-MM-DD format")
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def _parse_amount_param(value: Optional[str], name: str) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        return float(value.strip().replace(",", "."))
+    except ValueError:
+        raise ServiceError(400, f"{name} must be numeric")
+
+
+def parse_expense_filters(params: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """
+    Проверяет фильтры из query string: category, type (income|expense),
+    from/to (YYYY-MM-DD, включительно), min_amount/max_amount.
+    """
+    record_type = params.get("type") or None
+    if record_type not in (None, "income", "expense"):
+        raise ServiceError(400, "type must be income or expense")
+
+    date_from = _parse_date_param(params.get("from"), "from")
+    date_to = _parse_date_param(params.get("to"), "to")
+    if date_from and date_to and date_from > date_to:
+        raise ServiceError(400, "from must not be after to")
+
+    return {
+        "category": params.get("category") or None,
+        "type": record_type,
+        "from": date_from,
+        "to": date_to,
+        "min_amount": _parse_amount_param(params.get("min_amount"), "min_amount"),
+        "max_amount": _parse_amount_param(params.get("max_amount"), "max_amount"),
+    }
+
+
+def apply_expense_filters(query, filters: Dict[str, Any]):
+    if filters.get("category"):
+        query = query.eq("category", filters["category"])
+    if filters.get("type") == "income":
+        query = query.eq("type", "income")
+    elif filters.get("type") == "expense":
+        # Всё, что не доход, считается расходом — и строки без type тоже
+        # (neq отбрасывает NULL)
+        query = query.or_("type.is.null,type.neq.income")
+    if filters.get("from"):
+        query = query.gte("created_at", _utc_iso(filters["from"]))
+    if filters.get("to"):
+        query = query.lt("created_at", _utc_iso(filters["to"] + timedelta(days=1)))
+    if filters.get("min_amount") is not None:
+        query = query.gte("amount", filters["min_amount"])
+    if filters.get("max_amount") is not None:
+        query = query.lte("amount", filters["max_amount"])
+    return query
+
+
+def history_page(user_id: int, cursor: Optional[str], limit: int, filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Страница истории операций (keyset по created_at, id).
+
+    Returns:
+        {"items", "next_cursor"}
+    """
+    if limit < 1 or limit > HISTORY_PAGE_MAX:
+        raise ServiceError(400, f"limit must be between 1 and {HISTORY_PAGE_MAX}")
+
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            raise ServiceError(400, "Invalid cursor")
+
+    supabase = get_supabase_for_user(user_id)
+    query = supabase.table("expenses").select(HISTORY_COLUMNS).eq("user_id", user_id)
+    items, next_cursor = fetch_page(apply_expense_filters(query, filters), after, limit)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+# ---------- time series ----------
+
+def _bucket_start(day: date, bucket: str) -> date:
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(day: date, bucket: str) -> date:
+    if bucket == "week":
+        return day + timedelta(days=7)
+    if bucket == "month":
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def compute_timeseries(user_id: int, bucket: str, date_from: date, date_to: date,
+                       by_category: bool = False) -> Dict[str, Any]:
+    """
+    Доходы/расходы по корзинам (day|week|month) в виде параллельных массивов:
+    {"bucket", "labels", "income", "expense", "categories"?: {cat: [...]}}.
+    categories — разбивка расходов (как у круговой диаграммы в stats).
+    """
+    if bucket not in TIMESERIES_BUCKETS:
+        raise ServiceError(400, f"bucket must be one of {list(TIMESERIES_BUCKETS)}")
+    if date_from > date_to:
+        raise ServiceError(400, "from must not be after to")
+
+    labels: List[date] = []
+    cursor = _bucket_start(date_from, bucket)
+    while cursor <= date_to:
+        labels.append(cursor)
+        if len(labels) > MAX_TIMESERIES_POINTS:
+            raise ServiceError(400, f"Range too large (max {MAX_TIMESERIES_POINTS} points)")
+        cursor = _next_bucket(cursor, bucket)
+    index = {d.isoformat(): i for i, d in enumerate(labels)}
+
+    supabase = get_supabase_for_user(user_id)
+    try:
+        res = supabase.rpc("expense_timeseries", {
+            "p_user_id": user_id,
+            "p_from": date_from.isoformat(),
+            "p_to": date_to.isoformat(),
+            "p_bucket": bucket,
+            "p_by_category": by_category,
+        }).execute()
+    except Exception as e:
+        log_event("timeseries_failed", user_id, {"error": str(e)}, "error")
+        raise ServiceError(500, "Failed to load time series")
+
+    income = [0.0] * len(labels)
+    expense = [0.0] * len(labels)
+    categories: Dict[str, List[float]] = {}
+
+    for row in res.data or []:
+        i = index.get(str(row.get("bucket"))[:10])
+        if i is None:
+            continue
+        amount = to_number(row.get("amount"))
+        if row.get("type") == "income":
+            income[i] += amount
+        else:
+            expense[i] += amount
+            if by_category:
+                series = categories.setdefault(row.get("category") or "Other", [0.0] * len(labels))
+                series[i] += amount
+
+    result: Dict[str, Any] = {
+        "bucket": bucket,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "labels": [d.isoformat() for d in labels],
+        "income": income,
+        "expense": expense,
+    }
+    if by_category:
+        result["categories"] = categories
+    return result
+
+
+# ---------- AI assistant ----------
+
+def ask_assistant(user_id: int, message: str, with_history: bool = True) -> Dict[str, Any]:
+    """
+    Отвечает на сообщение пользователя с учётом финансового контекста.
+
+    Returns:
+        {"message", "context": {"balance", "daily_average"}}
+    """
+    log_event("ai_message", user_id, {"message": message[:100]})
+
+    # Контекст и история — независимые запросы, читаем одновременно
+    if with_history:
+        context, history = run_parallel(
+            lambda: get_financial_context(user_id),
+            lambda: get_chat_history(user_id, limit=10),
+        )
+    else:
+        context, history = get_financial_context(user_id), None
+
+    # Сохраняем сообщение пользователя (только если с историей)
+    if with_history:
+        save_chat_message(user_id, "user", message)
+
+    # Получаем ответ AI
+    ai_response = chat_with_ai(message, context, history)
+
+    # Сохраняем ответ AI (только если с историей)
+    if with_history:
+        save_chat_message(user_id, "assistant", ai_response)
+
+    log_event("ai_response", user_id, {"response_len": len(ai_response)})
+
+    return {
+        "message": ai_response,
+        "context": {
+            "balance": context.get("balance"),
+            "daily_average": context.get("daily_average")
+        }
+    }
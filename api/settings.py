@@ -1,6 +1,7 @@
 from http.server import BaseHTTPRequestHandler
 
 from api.auth import require_user_id
+from api.cache import bump_user_version
 from api.db import get_supabase_for_user
 from api.utils import read_json, send_ok, send_error
 
@@ -39,5 +40,6 @@ class handler(BaseHTTPRequestHandler):
         }
 
         supabase.table("user_settings").upsert(data).execute()
+        bump_user_version(user_id)
 
         send_ok(self, {"currency": currency})
@@ -1,25 +1,36 @@
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from api.auth import require_user_id
-from api.db import get_supabase_for_user
-from api.utils import send_ok, send_error
+from api.services import HISTORY_DICT_FIELDS, HISTORY_FIELDS, ServiceError, get_multi_stats, get_stats
+from api.utils import columnar_fields, list_payload, send_ok, send_error
 
 
-MAX_RECORDS_FOR_CALC = 500  # safety cap
-
-
-def to_number(x) -> float:
+def _parse_date(value: str):
     try:
-        if isinstance(x, bool) or x is None:
-            return 0.0
-        if isinstance(x, (int, float)):
-            return float(x)
-        s = str(x).strip().replace(",", ".")
-        return float(s)
+        return datetime.strptime(value, "%Y-%m-%d").date()
     except Exception:
-        return 0.0
+        return None
+
+
+def _columnar_history(data: dict, params: dict) -> dict:
+    """
+    format=columnar: history lists -> columns/rows. Copies instead of
+    mutating, the dict may be the cached one.
+    """
+    data = dict(data)
+    if "history" in data:
+        data["history"] = list_payload(data["history"], params, HISTORY_FIELDS, HISTORY_DICT_FIELDS)
+    if "periods" in data:
+        periods = {}
+        for key, entry in data["periods"].items():
+            if "history" in entry:
+                entry = dict(entry)
+                entry["history"] = list_payload(entry["history"], params, HISTORY_FIELDS, HISTORY_DICT_FIELDS)
+            periods[key] = entry
+        data["periods"] = periods
+    return data
 
 
 class handler(BaseHTTPRequestHandler):
@@ -29,103 +40,53 @@ class handler(BaseHTTPRequestHandler):
             return
 
         query = parse_qs(urlparse(self.path).query)
+
+        params = {k: v[0] for k, v in query.items()}
+        try:
+            columnar = columnar_fields(params, HISTORY_FIELDS) is not None
+        except ValueError as e:
+            send_error(self, 400, str(e))
+            return
+
+        # Несколько периодов сразу: ?periods=day,week,month,all&from=&to=&compare=1
+        if "periods" in query or "from" in query or "to" in query:
+            self._send_multi(user_id, query, params if columnar else None)
+            return
+
         period = (query.get("period", ["all"])[0] or "all").lower()
-        if period not in ("all", "day", "week", "month"):
-            send_error(self, 400, "Invalid period")
+
+        try:
+            response_data, cache_hit = get_stats(user_id, period)
+        except ServiceError as e:
+            send_error(self, e.status, e.message)
             return
 
-        supabase = get_supabase_for_user(user_id)
-
-        settings_res = (
-            supabase.table("user_settings")
-            .select("currency")
-            .eq("user_id", user_id)
-            .execute()
-        )
-        currency = settings_res.data[0].get("currency") if settings_res.data else "RUB"
-
-        # Pull limited recent records (better than fetching everything)
-        all_data = (
-            supabase.table("expenses")
-            .select("*")
-            .eq("user_id", user_id)
-            .order("created_at", desc=True)
-            .limit(MAX_RECORDS_FOR_CALC)
-            .execute()
-        )
-        records = all_data.data or []
-
-        subs_res = (
-            supabase.table("subscriptions")
-            .select("*")
-            .eq("user_id", user_id)
-            .order("next_date")
-            .execute()
-        )
-        subs_data = subs_res.data or []
-
-        # Total balance (over fetched window; for full balance use DB aggregate)
-        total_balance = 0.0
-        for item in records:
-            amt = to_number(item.get("amount"))
-            if item.get("type") == "income":
-                total_balance += amt
-            else:
-                total_balance -= amt
-
-        now = datetime.utcnow()
-        start_date = None
-        if period == "day":
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        elif period == "week":
-            start_date = now - timedelta(days=7)
-        elif period == "month":
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-        filtered_records = []
-        for item in records:
-            if not start_date:
-                filtered_records.append(item)
-                continue
-
-            created_at = item.get("created_at")
-            if not created_at:
-                filtered_records.append(item)
-                continue
-
-            rec_date_str = str(created_at).split(".")[0].replace("Z", "")
-            try:
-                rec_date = datetime.fromisoformat(rec_date_str)
-                if rec_date >= start_date:
-                    filtered_records.append(item)
-            except Exception:
-                filtered_records.append(item)
-
-        stats = {}
-        period_income = 0.0
-        period_expense = 0.0
-
-        for item in filtered_records:
-            amt = to_number(item.get("amount"))
-            if item.get("type") == "income":
-                period_income += amt
-            else:
-                period_expense += amt
-                cat = item.get("category") or "Other"
-                stats[cat] = stats.get(cat, 0.0) + amt
-
-        # Optional: sort chart categories by spend desc
-        sorted_items = sorted(stats.items(), key=lambda kv: kv[1], reverse=True)
-        labels = [k for k, _ in sorted_items]
-        values = [v for _, v in sorted_items]
-
-        response_data = {
-            "currency": currency,
-            "total_balance": total_balance,
-            "period": {"income": period_income, "expense": period_expense},
-            "chart": {"labels": labels, "data": values},
-            "history": filtered_records[:20],
-            "subscriptions": subs_data,
-        }
-
-        send_ok(self, response_data)
+        if columnar:
+            response_data = _columnar_history(response_data, params)
+
+        send_ok(self, response_data, headers={"X-Cache": "HIT" if cache_hit else "MISS"})
+
+    def _send_multi(self, user_id: int, query: dict, columnar_params: dict = None):
+        raw_periods = query.get("periods", [""])[0]
+        periods = [p.strip().lower() for p in raw_periods.split(",") if p.strip()]
+        compare = query.get("compare", ["0"])[0] in ("1", "true")
+
+        custom = None
+        if "from" in query or "to" in query:
+            date_from = _parse_date(query.get("from", [""])[0])
+            date_to = _parse_date(query.get("to", [""])[0])
+            if date_from is None or date_to is None:
+                send_error(self, 400, "from/to must be in YYYY-MM-DD format")
+                return
+            custom = (date_from, date_to)
+
+        try:
+            response_data, cache_hit = get_multi_stats(user_id, periods, custom, compare)
+        except ServiceError as e:
+            send_error(self, e.status, e.message)
+            return
+
+        if columnar_params is not None:
+            response_data = _columnar_history(response_data, columnar_params)
+
+        send_ok(self, response_data, headers={"X-Cache": "HIT" if cache_hit else "MISS"})
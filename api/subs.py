@@ -1,27 +1,18 @@
 from http.server import BaseHTTPRequestHandler
 from datetime import datetime
 
+from api.analytics import parse_amount
 from api.auth import require_user_id
+from api.cache import bump_user_version
 from api.db import get_supabase_for_user
-from api.utils import read_json, send_ok, send_error
+from api.utils import columnar_fields, list_payload, read_json, send_ok, send_error
 
 
 ALLOWED_PERIODS = {"daily", "weekly", "monthly", "yearly"}
 ALLOWED_CURRENCIES = {"RUB", "USD", "EUR"}
-
-
-def _to_number(x):
-    try:
-        if isinstance(x, bool):
-            return None
-        if isinstance(x, (int, float)):
-            return float(x)
-        if x is None:
-            return None
-        s = str(x).strip().replace(",", ".")
-        return float(s)
-    except Exception:
-        return None
+# action=list с format=columnar
+LIST_FIELDS = ("id", "name", "amount", "currency", "period", "next_date")
+LIST_DICT_FIELDS = ("currency", "period")
 
 
 def _is_iso_date(value: str) -> bool:
@@ -54,14 +45,19 @@ class handler(BaseHTTPRequestHandler):
 
         # 3) Actions
         if action == "list":
+            try:
+                fields = columnar_fields(body, LIST_FIELDS)
+            except ValueError as e:
+                send_error(self, 400, str(e))
+                return
             res = (
                 supabase.table("subscriptions")
-                .select("*")
+                .select(", ".join(fields) if fields else "*")
                 .eq("user_id", user_id)
                 .order("next_date")
                 .execute()
             )
-            send_ok(self, {"subscriptions": res.data or []})
+            send_ok(self, {"subscriptions": list_payload(res.data or [], body, LIST_FIELDS, LIST_DICT_FIELDS)})
             return
 
         if action == "delete":
@@ -85,6 +81,7 @@ class handler(BaseHTTPRequestHandler):
                 send_error(self, 404, "Subscription not found")
                 return
 
+            bump_user_version(user_id)
             send_ok(self, {"message": "Deleted"})
             return
 
@@ -95,7 +92,7 @@ class handler(BaseHTTPRequestHandler):
             return
         name = name.strip()
 
-        amount = _to_number(body.get("amount"))
+        amount = parse_amount(body.get("amount"))
         if amount is None:
             send_error(self, 400, "amount must be numeric")
             return
@@ -139,6 +136,7 @@ class handler(BaseHTTPRequestHandler):
         }
 
         supabase.table("subscriptions").insert(data).execute()
+        bump_user_version(user_id)
         send_ok(self, {"message": "Subscription added"})
         return
 
@@ -0,0 +1,54 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timedelta
+
+from api.auth import require_user_id
+from api.services import ServiceError, compute_timeseries
+from api.utils import send_ok, send_error
+
+
+DEFAULT_RANGE_DAYS = 30
+
+
+def _parse_date(value: str):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except Exception:
+        return None
+
+
+class handler(BaseHTTPRequestHandler):
+    """
+    GET /api/timeseries?bucket=day|week|month&from=YYYY-MM-DD&to=YYYY-MM-DD&by_category=1
+
+    Response: {"bucket", "from", "to", "labels": [...], "income": [...],
+               "expense": [...], "categories": {"Еда": [...], ...}}
+    """
+
+    def do_GET(self):
+        user_id = require_user_id(self)
+        if user_id is None:
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        bucket = (query.get("bucket", ["day"])[0] or "day").lower()
+        by_category = query.get("by_category", ["0"])[0] in ("1", "true")
+
+        date_to = datetime.utcnow().date()
+        if query.get("to"):
+            date_to = _parse_date(query["to"][0])
+        date_from = date_to - timedelta(days=DEFAULT_RANGE_DAYS - 1) if date_to else None
+        if query.get("from"):
+            date_from = _parse_date(query["from"][0])
+
+        if date_from is None or date_to is None:
+            send_error(self, 400, "from/to must be in YYYY-MM-DD format")
+            return
+
+        try:
+            result = compute_timeseries(user_id, bucket, date_from, date_to, by_category)
+        except ServiceError as e:
+            send_error(self, e.status, e.message)
+            return
+
+        send_ok(self, result)
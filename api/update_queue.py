@@ -0,0 +1,203 @@
+# api/update_queue.py
+# Durable queue of Telegram updates for asynchronous webhook processing.
+#
+# The webhook (bot.py) only validates and enqueues the update and answers
+# Telegram right away; a worker drains the queue and runs the handlers.
+#
+# Delivery is at-least-once: claim() hides an item for VISIBILITY_TIMEOUT
+# seconds, ack() deletes it. If the worker dies before ack(), the item
+# becomes visible again and is retried (up to MAX_ATTEMPTS).
+#
+# The worker claims one item at a time (CLAIM_SIZE), so visibility starts
+# when handling starts: a batch claimed up front would run out of
+# visibility behind slow handlers (AI answers, exports), and another worker
+# would process its tail again. run_worker() refuses to start unless
+# CLAIM_SIZE x BOT_QUEUE_MAX_HANDLING_SECONDS < VISIBILITY_TIMEOUT.
+#
+# Backends (BOT_QUEUE_BACKEND):
+#   ""/"off"   - disabled, webhook processes updates synchronously
+#   "sqlite"   - local file (BOT_QUEUE_PATH), for self-hosted single-box setups
+#   "supabase" - table bot_update_queue (sql/002_bot_update_queue.sql)
+#
+# Worker:
+#   python -m api.update_queue
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from api.logger import log_event
+
+BOT_QUEUE_BACKEND = os.environ.get("BOT_QUEUE_BACKEND", "").lower()
+BOT_QUEUE_PATH = os.environ.get("BOT_QUEUE_PATH", "/tmp/bot_updates.sqlite3")
+VISIBILITY_TIMEOUT = int(os.environ.get("BOT_QUEUE_VISIBILITY_TIMEOUT", "120"))
+MAX_ATTEMPTS = int(os.environ.get("BOT_QUEUE_MAX_ATTEMPTS", "5"))
+# Худшее время обработки одного update (AI, выгрузка файлом)
+MAX_HANDLING_SECONDS = int(os.environ.get("BOT_QUEUE_MAX_HANDLING_SECONDS", "60"))
+CLAIM_SIZE = 1
+# Сколько элементов drain() обрабатывает за вызов
+BATCH_SIZE = 20
+IDLE_SLEEP_SECONDS = 0.5
+
+
+class QueuedUpdate(NamedTuple):
+    id: int
+    update: Dict[str, Any]
+    attempts: int
+
+
+class SQLiteUpdateQueue:
+    def __init__(self, path: str = BOT_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_update_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                update_id INTEGER UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS bot_update_queue_visible ON bot_update_queue (visible_at)"
+        )
+
+    def enqueue(self, update: Dict[str, Any]) -> bool:
+        """Returns False if an update with the same update_id is already queued."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO bot_update_queue (update_id, payload, visible_at) VALUES (?, ?, ?)",
+                (update.get("update_id"), json.dumps(update, ensure_ascii=False), time.time()),
+            )
+            return cur.rowcount > 0
+
+    def claim(self, limit: int = CLAIM_SIZE, visibility_timeout: int = VISIBILITY_TIMEOUT) -> List[QueuedUpdate]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, payload, attempts FROM bot_update_queue "
+                    "WHERE visible_at <= ? ORDER BY id LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE bot_update_queue SET visible_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        [(now + visibility_timeout, row[0]) for row in rows],
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [QueuedUpdate(row[0], json.loads(row[1]), row[2] + 1) for row in rows]
+
+    def ack(self, item_id: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM bot_update_queue WHERE id = ?", (item_id,))
+
+
+class SupabaseUpdateQueue:
+    def __init__(self):
+        from api.db import get_supabase_admin
+        self._supabase = get_supabase_admin()
+
+    def enqueue(self, update: Dict[str, Any]) -> bool:
+        res = (
+            self._supabase.table("bot_update_queue")
+            .upsert(
+                {"update_id": update.get("update_id"), "payload": update},
+                on_conflict="update_id",
+                ignore_duplicates=True,
+            )
+            .execute()
+        )
+        return bool(res.data)
+
+    def claim(self, limit: int = CLAIM_SIZE, visibility_timeout: int = VISIBILITY_TIMEOUT) -> List[QueuedUpdate]:
+        res = self._supabase.rpc(
+            "claim_bot_updates",
+            {"p_limit": limit, "p_visibility_seconds": visibility_timeout},
+        ).execute()
+        return [QueuedUpdate(row["id"], row["payload"], row["attempts"]) for row in (res.data or [])]
+
+    def ack(self, item_id: int) -> None:
+        self._supabase.table("bot_update_queue").delete().eq("id", item_id).execute()
+
+
+_queue = None
+
+
+def get_update_queue():
+    """Returns the configured queue (singleton) or None if async mode is off."""
+    global _queue
+    if _queue is None:
+        if BOT_QUEUE_BACKEND == "sqlite":
+            _queue = SQLiteUpdateQueue()
+        elif BOT_QUEUE_BACKEND == "supabase":
+            _queue = SupabaseUpdateQueue()
+    return _queue
+
+
+def drain(queue, process: Callable[[Dict[str, Any]], Any], limit: int = BATCH_SIZE) -> int:
+    """
+    Processes up to `limit` items, claiming CLAIM_SIZE at a time. Items whose
+    processing raised are left in the queue and reappear after the
+    visibility timeout.
+
+    Returns:
+        number of claimed items
+    """
+    claimed = 0
+    while claimed < limit:
+        items = queue.claim(CLAIM_SIZE)
+        if not items:
+            break
+        claimed += len(items)
+        for item in items:
+            if item.attempts > MAX_ATTEMPTS:
+                log_event("bot_update_dropped", 0, {"update_id": item.update.get("update_id"), "attempts": item.attempts}, "error")
+                queue.ack(item.id)
+                continue
+            try:
+                process(item.update)
+            except Exception as e:
+                log_event("bot_update_failed", 0, {"update_id": item.update.get("update_id"), "error": str(e)}, "error")
+                continue
+            queue.ack(item.id)
+    return claimed
+
+
+def run_worker(process: Optional[Callable[[Dict[str, Any]], Any]] = None) -> None:
+    """Drains the queue forever; sleeps briefly when it is empty."""
+    queue = get_update_queue()
+    if queue is None:
+        raise RuntimeError("BOT_QUEUE_BACKEND is not set (use sqlite or supabase)")
+    if CLAIM_SIZE * MAX_HANDLING_SECONDS >= VISIBILITY_TIMEOUT:
+        raise RuntimeError(
+            "BOT_QUEUE_VISIBILITY_TIMEOUT must exceed the claimed items' worst-case handling "
+            f"({CLAIM_SIZE} x {MAX_HANDLING_SECONDS}s)"
+        )
+
+    if process is None:
+        from api.bot import process_update
+        process = process_update
+
+    log_event("bot_queue_worker_started", 0, {"backend": BOT_QUEUE_BACKEND})
+    while True:
+        if drain(queue, process) == 0:
+            time.sleep(IDLE_SLEEP_SECONDS)
+
+
+if __name__ == "__main__":
+    run_worker()
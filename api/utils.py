@@ -3,16 +3,28 @@
 # - standardized JSON responses
 # - safe JSON body reading with size limits
 # - optional CORS helpers
+# - opt-in columnar encoding for list payloads
+# - gzip/br compression of JSON bodies (see api/compression.py)
+# - chunked streaming responses (send_stream)
 #
 # Response format:
 #   Success: { "ok": true, "data": ... }
 #   Error:   { "ok": false, "error": "message" }
+#
+# Columnar lists (format=columnar[&fields=a,b][&dict=0]):
+#   { "columns": ["a", "b"], "rows": [[1, 0], [2, 1]],
+#     "dictionaries": { "b": ["x", "y"] } }
+# Dictionary-encoded columns hold indexes into "dictionaries" (null stays null).
 
 from __future__ import annotations
 
+import itertools
 import json
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from api.compression import StreamCompressor, compress, negotiate
+from api.logger import log_event
 
 DEFAULT_MAX_BODY_BYTES = 32 * 1024  # 32 KB
 
@@ -32,18 +44,86 @@ def _send_common_headers(handler) -> None:
     handler.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
 
 
-def send_json(handler, status: int, payload: Dict[str, Any]) -> None:
+def accept_encoding(handler) -> Optional[str]:
+    request_headers = getattr(handler, "headers", None)
+    return request_headers.get("Accept-Encoding") if request_headers is not None else None
+
+
+def send_json(handler, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
     body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    body, encoding = compress(body, accept_encoding(handler))
     handler.send_response(status)
     _send_common_headers(handler)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
     handler.send_header("Content-Type", "application/json; charset=utf-8")
+    handler.send_header("Vary", "Accept-Encoding")
+    if encoding:
+        handler.send_header("Content-Encoding", encoding)
     handler.send_header("Content-Length", str(len(body)))
     handler.end_headers()
     handler.wfile.write(body)
 
 
-def send_ok(handler, data: Any, status: int = 200) -> None:
-    send_json(handler, status, {"ok": True, "data": data})
+def send_ok(handler, data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+    send_json(handler, status, {"ok": True, "data": data}, headers=headers)
+
+
+def send_stream(handler, chunks: Iterable[bytes], content_type: str, headers: Optional[Dict[str, str]] = None,
+                status: int = 200, compressible: bool = True) -> None:
+    """
+    Writes chunks as they are produced (Transfer-Encoding: chunked), so
+    memory stays flat and the first bytes leave before the last row is read.
+    Only this response is sent as HTTP/1.1 (chunked needs it), with
+    Connection: close; the handler class keeps the HTTP/1.0 default, so its
+    other responses need no Content-Length. HTTP/1.0 clients get the raw
+    bytes delimited by the connection close.
+
+    The first chunk is produced before the status line: errors up to it
+    propagate and the caller can still answer with send_error. A later
+    error truncates the body (no terminating chunk), which clients report
+    as a failed download instead of a silently short file.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, b"")
+    compressor = StreamCompressor(negotiate(accept_encoding(handler)) if compressible else None)
+
+    chunked = getattr(handler, "request_version", "HTTP/1.0") >= "HTTP/1.1"
+    if chunked:
+        # Только для этого ответа (атрибут экземпляра, не класса)
+        handler.protocol_version = "HTTP/1.1"
+
+    handler.send_response(status)
+    _send_common_headers(handler)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.send_header("Content-Type", content_type)
+    if compressible:
+        handler.send_header("Vary", "Accept-Encoding")
+    if compressor.encoding:
+        handler.send_header("Content-Encoding", compressor.encoding)
+    if chunked:
+        handler.send_header("Transfer-Encoding", "chunked")
+    handler.send_header("Connection", "close")
+    handler.end_headers()
+
+    def write(data: bytes) -> None:
+        if not data:
+            return
+        if chunked:
+            handler.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        else:
+            handler.wfile.write(data)
+
+    try:
+        for chunk in itertools.chain((first,), chunks):
+            write(compressor.compress(chunk))
+        write(compressor.finish())
+        if chunked:
+            handler.wfile.write(b"0\r\n\r\n")
+    except Exception as e:
+        log_event("stream_aborted", 0, {"error": str(e)}, "error")
+        handler.close_connection = True
 
 
 def send_error(handler, status: int, message: str) -> None:
@@ -105,4 +185,57 @@ def read_json(handler, *, max_bytes: int = DEFAULT_MAX_BODY_BYTES) -> Optional[D
         send_error(handler, 400, "JSON body must be an object")
         return None
 
-    return data
\ No newline at end of file
+    return data
+
+
+def columnar_fields(params: Dict[str, Any], allowed: Sequence[str]) -> Optional[List[str]]:
+    """
+    None unless params ask for format=columnar; otherwise the requested
+    fields (comma string or list, default: all allowed) in request order.
+    Raises ValueError on unknown fields.
+    """
+    if str(params.get("format") or "").lower() != "columnar":
+        return None
+    raw = params.get("fields")
+    if not raw:
+        return list(allowed)
+    requested = raw.split(",") if isinstance(raw, str) else raw
+    fields = [str(f).strip() for f in requested if str(f).strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return fields or list(allowed)
+
+
+def to_columnar(rows: Iterable[Dict[str, Any]], fields: Sequence[str],
+                dictionary: Sequence[str] = ()) -> Dict[str, Any]:
+    """Rows of dicts -> {"columns", "rows"[, "dictionaries"]}."""
+    encoded = [f for f in fields if f in dictionary]
+    lookups: Dict[str, Dict[Any, int]] = {f: {} for f in encoded}
+    out_rows = []
+    for row in rows:
+        values = [row.get(f) for f in fields]
+        for i, field in enumerate(fields):
+            if field in lookups and values[i] is not None:
+                index = lookups[field]
+                values[i] = index.setdefault(values[i], len(index))
+        out_rows.append(values)
+
+    result: Dict[str, Any] = {"columns": list(fields), "rows": out_rows}
+    if encoded:
+        result["dictionaries"] = {f: list(lookups[f]) for f in encoded}
+    return result
+
+
+def list_payload(rows: List[Dict[str, Any]], params: Dict[str, Any], allowed: Sequence[str],
+                 dictionary: Sequence[str] = ()) -> Any:
+    """
+    rows unchanged, or their columnar form if params ask for it
+    (dict=0 turns dictionary encoding off). Raises ValueError on bad fields.
+    """
+    fields = columnar_fields(params, allowed)
+    if fields is None:
+        return rows
+    if str(params.get("dict", "1")) in ("0", "false"):
+        dictionary = ()
+    return to_columnar(rows, fields, dictionary)
@@ -0,0 +1,174 @@
+# api/xlsx.py
+# Minimal streaming XLSX writer (stdlib only).
+#
+#   for chunk in iter_xlsx([("Sheet", batches_of_rows), ...]):
+#       write(chunk)
+#
+# The workbook is a zip written to an unseekable sink (zipfile uses data
+# descriptors then), sheets are written row batch by row batch and the
+# compressed bytes are handed out as they are produced: memory stays
+# ~one batch, the file is never built in RAM.
+#
+# Cells: str -> inline string, int/float -> number, date/datetime -> date
+# (serial number with a date format), None and nan/inf -> empty. No shared
+# strings, no formulas; one sheet stream must stay under 4 GiB (no zip64).
+
+from __future__ import annotations
+
+import math
+import re
+import zipfile
+from datetime import date, datetime
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+_EPOCH = date(1899, 12, 30)
+# Символы, запрещённые в XML 1.0
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f'<styleSheet xmlns="{_NS}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    "</styleSheet>"
+)
+_DATE_STYLE = 1
+
+
+class _Sink:
+    """Write-only, unseekable: collects what zipfile writes until drained."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _column(index: int) -> str:
+    name = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+def _cell(ref: str, value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        value = str(value)
+    if isinstance(value, float) and not math.isfinite(value):
+        # nan/inf в <v> Excel считает повреждением файла
+        return ""
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"><v>{value!r}</v></c>'
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="{_DATE_STYLE}"><v>{(value - _EPOCH).days}</v></c>'
+    text = escape(_INVALID_XML.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(number: int, values: Sequence[Any]) -> str:
+    cells = "".join(_cell(f"{_column(i)}{number}", v) for i, v in enumerate(values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+def _workbook_parts(names: List[str]) -> List[Tuple[str, str]]:
+    overrides = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(names) + 1)
+    )
+    sheets = "".join(
+        f'<sheet name={quoteattr(_INVALID_XML.sub("", name)[:31])} sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(names, 1)
+    )
+    sheet_rels = "".join(
+        f'<Relationship Id="rId{i}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(names) + 1)
+    )
+    styles_id = len(names) + 1
+    header = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    return [
+        ("[Content_Types].xml",
+         header + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+         '<Default Extension="xml" ContentType="application/xml"/>'
+         '<Override PartName="/xl/workbook.xml" '
+         'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+         '<Override PartName="/xl/styles.xml" '
+         'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+         f"{overrides}</Types>"),
+        ("_rels/.rels",
+         header + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" '
+         'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+         'Target="xl/workbook.xml"/></Relationships>'),
+        ("xl/workbook.xml",
+         header + f'<workbook xmlns="{_NS}" xmlns:r="{_REL_NS}"><sheets>{sheets}</sheets></workbook>'),
+        ("xl/_rels/workbook.xml.rels",
+         header + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         f"{sheet_rels}"
+         f'<Relationship Id="rId{styles_id}" '
+         'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+         'Target="styles.xml"/></Relationships>'),
+        ("xl/styles.xml", _STYLES),
+    ]
+
+
+def iter_xlsx(sheets: Sequence[Tuple[str, Iterable[Iterable[Sequence[Any]]]]]) -> Iterator[bytes]:
+    """
+    sheets: [(name, batches)], a batch is a list of rows (lists of values).
+    Batches are consumed lazily; sheets are written in order.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in _workbook_parts([name for name, _ in sheets]):
+            zf.writestr(name, content)
+        yield sink.drain()
+
+        for i, (_, batches) in enumerate(sheets, 1):
+            with zf.open(f"xl/worksheets/sheet{i}.xml", "w") as sheet:
+                sheet.write(
+                    f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet xmlns="{_NS}"><sheetData>'
+                    .encode("utf-8")
+                )
+                number = 0
+                for batch in batches:
+                    parts = []
+                    for values in batch:
+                        number += 1
+                        parts.append(_row(number, values))
+                    sheet.write("".join(parts).encode("utf-8"))
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+                sheet.write(b"</sheetData></worksheet>")
+            yield sink.drain()
+    # Центральный каталог zip
+    yield sink.drain()
@@ -0,0 +1,35 @@
+-- 001_user_jwt_rls.sql
+-- RLS по claim'у user_id из JWT, который выпускает api/db.py (sign_user_token).
+-- Заменяет RPC set_user_context: личность пользователя приходит с каждым
+-- запросом в заголовке Authorization, без отдельного round trip.
+--
+-- JWT подписывается тем же секретом, что и у проекта Supabase
+-- (Settings -> API -> JWT Secret), он же SUPABASE_JWT_SECRET в окружении.
+
+create or replace function public.request_user_id()
+returns bigint
+language sql
+stable
+as $$
+  select nullif(auth.jwt() ->> 'user_id', '')::bigint;
+$$;
+
+do $$
+declare
+  t text;
+begin
+  foreach t in array array[
+    'expenses', 'subscriptions', 'user_settings', 'quick_buttons', 'ai_chat_history'
+  ]
+  loop
+    execute format('alter table public.%I enable row level security', t);
+    execute format('drop policy if exists "own_rows_jwt" on public.%I', t);
+    execute format(
+      'create policy "own_rows_jwt" on public.%I for all to authenticated '
+      'using (user_id = public.request_user_id()) '
+      'with check (user_id = public.request_user_id())',
+      t
+    );
+  end loop;
+end
+$$;
@@ -0,0 +1,39 @@
+-- 002_bot_update_queue.sql
+-- Очередь update'ов Telegram для асинхронного вебхука
+-- (api/update_queue.py, BOT_QUEUE_BACKEND=supabase).
+
+create table if not exists public.bot_update_queue (
+  id bigserial primary key,
+  update_id bigint unique,
+  payload jsonb not null,
+  attempts int not null default 0,
+  visible_at timestamptz not null default now(),
+  created_at timestamptz not null default now()
+);
+
+create index if not exists bot_update_queue_visible_idx
+  on public.bot_update_queue (visible_at);
+
+-- Доступ только через service key (бот/воркер)
+alter table public.bot_update_queue enable row level security;
+
+-- Атомарно забирает пачку видимых элементов и скрывает их на p_visibility_seconds.
+-- Несколько воркеров не получат один и тот же элемент (skip locked), пока
+-- обработка укладывается в p_visibility_seconds: воркер берёт по одному
+-- элементу (api/update_queue.py, CLAIM_SIZE).
+create or replace function public.claim_bot_updates(p_limit int, p_visibility_seconds int)
+returns table (id bigint, payload jsonb, attempts int)
+language sql
+as $$
+  update public.bot_update_queue q
+     set visible_at = now() + make_interval(secs => p_visibility_seconds),
+         attempts = q.attempts + 1
+   where q.id in (
+     select id from public.bot_update_queue
+      where visible_at <= now()
+      order by id
+      limit p_limit
+      for update skip locked
+   )
+  returning q.id, q.payload, q.attempts;
+$$;
@@ -0,0 +1,17 @@
+-- 003_processed_updates.sql
+-- Дедупликация update'ов Telegram по update_id (api/dedup.py, BOT_DEDUP_STORE=supabase).
+
+create table if not exists public.processed_updates (
+  update_id bigint primary key,
+  created_at timestamptz not null default now()
+);
+
+alter table public.processed_updates enable row level security;
+
+-- Telegram повторяет доставку максимум сутки; старые ключи не нужны.
+create or replace function public.prune_processed_updates()
+returns void
+language sql
+as $$
+  delete from public.processed_updates where created_at < now() - interval '2 days';
+$$;
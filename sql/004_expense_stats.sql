@@ -0,0 +1,47 @@
+-- 004_expense_stats.sql
+-- Агрегаты для GET /api/stats (api/services.fetch_stats_aggregate).
+-- Считаются по всей истории пользователя, без лимита в 500 строк;
+-- в ответе только итоги и разбивка по категориям.
+--
+-- Правила совпадают с прежним расчётом в Python:
+--   * всё, что не type = 'income', считается расходом
+--   * записи без created_at попадают в любой период
+--   * пустая категория -> 'Other'
+
+create or replace function public.expense_stats(p_user_id bigint, p_since timestamptz default null)
+returns jsonb
+language sql
+stable
+as $$
+  with base as (
+    select
+      type = 'income' as is_income,
+      coalesce(nullif(category, ''), 'Other') as category,
+      amount::numeric as amount,
+      (p_since is null or created_at is null or created_at >= p_since) as in_period
+    from public.expenses
+    where user_id = p_user_id
+  ),
+  cats as (
+    select category, sum(amount) as amount
+    from base
+    where in_period and is_income is not true
+    group by category
+  )
+  select jsonb_build_object(
+    'total_balance', coalesce(sum(case when is_income then amount else -amount end), 0),
+    'income', coalesce(sum(amount) filter (where in_period and is_income), 0),
+    'expense', coalesce(sum(amount) filter (where in_period and is_income is not true), 0),
+    'categories', (
+      select coalesce(
+        jsonb_agg(jsonb_build_object('category', category, 'amount', amount) order by amount desc),
+        '[]'::jsonb
+      )
+      from cats
+    )
+  )
+  from base;
+$$;
+
+create index if not exists expenses_user_created_idx
+  on public.expenses (user_id, created_at desc);
@@ -0,0 +1,224 @@
+-- 005_expense_rollups.sql
+-- Инкрементальные свёртки по пользователю:
+--   expense_rollup_daily   (user_id, day,   type, category) -> amount, count
+--   expense_rollup_monthly (user_id, month, type, category) -> amount, count
+--
+-- Поддерживаются триггерами на expenses (уровня statement, с transition
+-- tables), поэтому любой писатель — index.py, delete.py, process-receipt.py,
+-- bulk insert бота — обновляет их одной агрегированной операцией на запрос.
+-- Пересборка: select public.rebuild_expense_rollups();  (или python -m api.rollups)
+--
+-- Нормализация та же, что в expense_stats: всё, что не 'income', — 'expense';
+-- пустая категория -> 'Other'; день/месяц считаются в UTC.
+
+create table if not exists public.expense_rollup_daily (
+  user_id bigint not null,
+  day date not null,
+  type text not null,
+  category text not null,
+  amount numeric not null default 0,
+  count int not null default 0,
+  primary key (user_id, day, type, category)
+);
+
+create table if not exists public.expense_rollup_monthly (
+  user_id bigint not null,
+  month date not null,
+  type text not null,
+  category text not null,
+  amount numeric not null default 0,
+  count int not null default 0,
+  primary key (user_id, month, type, category)
+);
+
+alter table public.expense_rollup_daily enable row level security;
+alter table public.expense_rollup_monthly enable row level security;
+
+drop policy if exists "own_rows_jwt" on public.expense_rollup_daily;
+create policy "own_rows_jwt" on public.expense_rollup_daily
+  for select to authenticated using (user_id = public.request_user_id());
+
+drop policy if exists "own_rows_jwt" on public.expense_rollup_monthly;
+create policy "own_rows_jwt" on public.expense_rollup_monthly
+  for select to authenticated using (user_id = public.request_user_id());
+
+
+-- Применяет дельты (sign = 1 для новых строк, -1 для удалённых)
+create or replace function public.apply_expense_rollup_delta(p_rows jsonb, p_sign int)
+returns void
+language sql
+security definer
+set search_path = public
+as $$
+  with src as (
+    select
+      (r ->> 'user_id')::bigint as user_id,
+      (coalesce((r ->> 'created_at')::timestamptz, now()) at time zone 'UTC')::date as day,
+      case when r ->> 'type' = 'income' then 'income' else 'expense' end as type,
+      coalesce(nullif(r ->> 'category', ''), 'Other') as category,
+      coalesce((r ->> 'amount')::numeric, 0) as amount
+    from jsonb_array_elements(p_rows) r
+  ),
+  daily as (
+    insert into public.expense_rollup_daily as d (user_id, day, type, category, amount, count)
+    select user_id, day, type, category, p_sign * sum(amount), p_sign * count(*)
+    from src
+    group by user_id, day, type, category
+    on conflict (user_id, day, type, category) do update
+      set amount = d.amount + excluded.amount,
+          count = d.count + excluded.count
+    returning 1
+  )
+  insert into public.expense_rollup_monthly as m (user_id, month, type, category, amount, count)
+  select user_id, date_trunc('month', day)::date, type, category, p_sign * sum(amount), p_sign * count(*)
+  from src
+  group by user_id, date_trunc('month', day)::date, type, category
+  on conflict (user_id, month, type, category) do update
+    set amount = m.amount + excluded.amount,
+        count = m.count + excluded.count;
+$$;
+
+
+create or replace function public.expense_rollups_on_insert()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  perform public.apply_expense_rollup_delta(
+    (select coalesce(jsonb_agg(to_jsonb(n)), '[]'::jsonb) from new_rows n), 1
+  );
+  return null;
+end
+$$;
+
+create or replace function public.expense_rollups_on_delete()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  perform public.apply_expense_rollup_delta(
+    (select coalesce(jsonb_agg(to_jsonb(o)), '[]'::jsonb) from old_rows o), -1
+  );
+  return null;
+end
+$$;
+
+create or replace function public.expense_rollups_on_update()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  perform public.apply_expense_rollup_delta(
+    (select coalesce(jsonb_agg(to_jsonb(o)), '[]'::jsonb) from old_rows o), -1
+  );
+  perform public.apply_expense_rollup_delta(
+    (select coalesce(jsonb_agg(to_jsonb(n)), '[]'::jsonb) from new_rows n), 1
+  );
+  return null;
+end
+$$;
+
+drop trigger if exists expenses_rollup_insert on public.expenses;
+create trigger expenses_rollup_insert
+  after insert on public.expenses
+  referencing new table as new_rows
+  for each statement execute function public.expense_rollups_on_insert();
+
+drop trigger if exists expenses_rollup_delete on public.expenses;
+create trigger expenses_rollup_delete
+  after delete on public.expenses
+  referencing old table as old_rows
+  for each statement execute function public.expense_rollups_on_delete();
+
+drop trigger if exists expenses_rollup_update on public.expenses;
+create trigger expenses_rollup_update
+  after update on public.expenses
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function public.expense_rollups_on_update();
+
+
+-- Полная пересборка (для всех или для одного пользователя).
+-- Обычный insert ... select ... group by: агрегирует сама БД (при нехватке
+-- памяти — с выгрузкой на диск), история не собирается в один jsonb.
+-- Месячные свёртки считаются из только что собранных дневных.
+create or replace function public.rebuild_expense_rollups(p_user_id bigint default null)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  delete from public.expense_rollup_daily where p_user_id is null or user_id = p_user_id;
+  delete from public.expense_rollup_monthly where p_user_id is null or user_id = p_user_id;
+
+  insert into public.expense_rollup_daily (user_id, day, type, category, amount, count)
+  select
+    e.user_id,
+    (coalesce(e.created_at, now()) at time zone 'UTC')::date,
+    case when e.type = 'income' then 'income' else 'expense' end,
+    coalesce(nullif(e.category, ''), 'Other'),
+    sum(coalesce(e.amount::numeric, 0)),
+    count(*)
+  from public.expenses e
+  where p_user_id is null or e.user_id = p_user_id
+  group by 1, 2, 3, 4;
+
+  insert into public.expense_rollup_monthly (user_id, month, type, category, amount, count)
+  select user_id, date_trunc('month', day)::date, type, category, sum(amount), sum(count)
+  from public.expense_rollup_daily
+  where p_user_id is null or user_id = p_user_id
+  group by 1, 2, 3, 4;
+end
+$$;
+
+revoke execute on function public.rebuild_expense_rollups(bigint) from public, anon, authenticated;
+revoke execute on function public.apply_expense_rollup_delta(jsonb, int) from public, anon, authenticated;
+
+
+-- expense_stats теперь читает свёртки: O(число корзин), а не O(история).
+-- Период задаётся с точностью до дня (UTC).
+create or replace function public.expense_stats(p_user_id bigint, p_since timestamptz default null)
+returns jsonb
+language sql
+stable
+as $$
+  with totals as (
+    select
+      coalesce(sum(case when type = 'income' then amount else -amount end), 0) as total_balance
+    from public.expense_rollup_monthly
+    where user_id = p_user_id
+  ),
+  period as (
+    select type, category, sum(amount) as amount
+    from public.expense_rollup_daily
+    where user_id = p_user_id
+      and (p_since is null or day >= (p_since at time zone 'UTC')::date)
+    group by type, category
+  )
+  select jsonb_build_object(
+    'total_balance', (select total_balance from totals),
+    'income', (select coalesce(sum(amount), 0) from period where type = 'income'),
+    'expense', (select coalesce(sum(amount), 0) from period where type = 'expense'),
+    'categories', (
+      select coalesce(
+        jsonb_agg(jsonb_build_object('category', category, 'amount', amount) order by amount desc),
+        '[]'::jsonb
+      )
+      from (
+        select category, sum(amount) as amount
+        from period
+        where type = 'expense'
+        group by category
+        having sum(amount) <> 0
+      ) c
+    )
+  );
+$$;
+
+select public.rebuild_expense_rollups();
@@ -0,0 +1,6 @@
+-- 006_expenses_keyset_index.sql
+-- Индекс под keyset-пагинацию истории (api/pagination.py):
+-- order by created_at desc nulls last, id desc.
+
+create index if not exists expenses_user_created_id_idx
+  on public.expenses (user_id, created_at desc nulls last, id desc);
@@ -0,0 +1,29 @@
+-- 007_expense_timeseries.sql
+-- Доходы/расходы по корзинам day|week|month за произвольный диапазон
+-- (GET /api/timeseries). Один grouped-запрос по дневным свёрткам
+-- (sql/005_expense_rollups.sql), без чтения сырых expenses.
+-- Неделя начинается с понедельника (date_trunc('week')).
+
+create or replace function public.expense_timeseries(
+  p_user_id bigint,
+  p_from date,
+  p_to date,
+  p_bucket text,
+  p_by_category boolean default false
+)
+returns table (bucket date, type text, category text, amount numeric)
+language sql
+stable
+as $$
+  select
+    date_trunc(p_bucket, d.day)::date as bucket,
+    d.type,
+    case when p_by_category then d.category end as category,
+    sum(d.amount) as amount
+  from public.expense_rollup_daily d
+  where d.user_id = p_user_id
+    and d.day between p_from and p_to
+    and p_bucket in ('day', 'week', 'month')
+  group by 1, 2, 3
+  order by 1;
+$$;
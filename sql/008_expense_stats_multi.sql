@@ -0,0 +1,26 @@
+-- 008_expense_stats_multi.sql
+-- Несколько периодов за один запрос (GET /api/stats?periods=...).
+-- p_ranges: [{"key": "month", "from": "2024-05-01", "to": null}, ...]
+--   from — включительно, to — исключительно, null — без границы.
+-- Все диапазоны считаются одним проходом по дневным свёрткам.
+
+create or replace function public.expense_stats_multi(p_user_id bigint, p_ranges jsonb)
+returns table (key text, type text, category text, amount numeric)
+language sql
+stable
+as $$
+  with r as (
+    select
+      x ->> 'key' as key,
+      (x ->> 'from')::date as d_from,
+      (x ->> 'to')::date as d_to
+    from jsonb_array_elements(p_ranges) x
+  )
+  select r.key, d.type, d.category, sum(d.amount) as amount
+  from public.expense_rollup_daily d
+  join r
+    on (r.d_from is null or d.day >= r.d_from)
+   and (r.d_to is null or d.day < r.d_to)
+  where d.user_id = p_user_id
+  group by r.key, d.type, d.category;
+$$;
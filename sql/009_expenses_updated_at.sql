@@ -0,0 +1,33 @@
+-- 009_expenses_updated_at.sql
+-- Время последнего изменения операции — для инкрементальной выгрузки
+-- (GET /api/export?since=<watermark>): в файл попадают строки, созданные
+-- или изменённые после метки прошлой выгрузки.
+-- Удаления так не видны: для них нужны «надгробия», здесь их нет.
+
+alter table public.expenses add column if not exists updated_at timestamptz;
+
+-- Заполнение старых строк не должно гонять триггер свёрток (сумма не меняется)
+alter table public.expenses disable trigger expenses_rollup_update;
+update public.expenses set updated_at = coalesce(created_at, now()) where updated_at is null;
+alter table public.expenses enable trigger expenses_rollup_update;
+
+alter table public.expenses alter column updated_at set default now();
+alter table public.expenses alter column updated_at set not null;
+
+create or replace function public.expenses_touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at := now();
+  return new;
+end
+$$;
+
+drop trigger if exists expenses_touch_updated_at on public.expenses;
+create trigger expenses_touch_updated_at
+  before update on public.expenses
+  for each row execute function public.expenses_touch_updated_at();
+
+create index if not exists expenses_user_updated_idx
+  on public.expenses (user_id, updated_at);
@@ -0,0 +1,32 @@
+-- 010_processed_updates_claims.sql
+-- Атомарный захват update'а перед обработкой (api/dedup.py, claim/mark_done).
+--
+--   status = 'processing' — update взят в работу в claimed_at
+--   status = 'done'       — обработан (или поставлен в очередь)
+--
+-- Повторная доставка — дубликат, пока строка 'done' или захват свежий.
+-- Захват старше аренды (упавший или убитый по таймауту вебхук) можно
+-- взять снова.
+
+alter table public.processed_updates
+  add column if not exists status text not null default 'done',
+  add column if not exists claimed_at timestamptz not null default now();
+
+-- true, если вызывающий получил update в обработку
+create or replace function public.claim_processed_update(p_update_id bigint, p_lease_seconds int)
+returns boolean
+language sql
+as $$
+  with claimed as (
+    insert into public.processed_updates as p (update_id, status, claimed_at)
+    values (p_update_id, 'processing', now())
+    on conflict (update_id) do update
+      set claimed_at = now()
+      where p.status = 'processing'
+        and p.claimed_at < now() - make_interval(secs => p_lease_seconds)
+    returning 1
+  )
+  select exists (select 1 from claimed);
+$$;
+
+revoke execute on function public.claim_processed_update(bigint, int) from public, anon, authenticated;
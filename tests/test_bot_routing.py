@@ -0,0 +1,43 @@
+from api import bot
+
+
+def test_income_line_is_expense_format():
+    assert bot.is_expense_format("+ 50000 зарплата")
+    assert bot.parse_expense_line("+ 50000 зарплата") == (
+        True, {"amount": 50000.0, "description": "зарплата", "category": "Разное"}
+    )
+
+
+def test_amount_last_line_is_expense_format():
+    assert bot.is_expense_format("кофе 500")
+    is_income, parsed = bot.parse_expense_line("кофе 500")
+    assert not is_income
+    assert parsed["amount"] == 500.0
+    assert parsed["description"] == "кофе"
+
+
+def test_question_is_not_expense_format():
+    assert not bot.is_expense_format("Сколько я потратил за месяц?")
+
+
+def _route(monkeypatch, text):
+    calls = []
+    monkeypatch.setattr(bot, "handle_expense_batch", lambda chat_id, user_id, lines: calls.append(("batch", lines)))
+    monkeypatch.setattr(bot, "handle_ai_message", lambda chat_id, user_id, text: calls.append(("ai", text)))
+    bot.process_update({"message": {"chat": {"id": 1}, "from": {"id": 1}, "text": text}})
+    return calls
+
+
+def test_batch_starting_with_income_line_goes_to_batch(monkeypatch):
+    calls = _route(monkeypatch, "+ 50000 зарплата\nкофе 300")
+    assert calls == [("batch", ["+ 50000 зарплата", "кофе 300"])]
+
+
+def test_batch_with_amount_last_goes_to_batch(monkeypatch):
+    calls = _route(monkeypatch, "кофе 500\nтакси 300\n1200 продукты")
+    assert calls == [("batch", ["кофе 500", "такси 300", "1200 продукты"])]
+
+
+def test_multiline_question_goes_to_ai(monkeypatch):
+    calls = _route(monkeypatch, "Привет!\nСколько я потратил на кофе\nв этом месяце?")
+    assert calls and calls[0][0] == "ai"
@@ -0,0 +1,70 @@
+import base64
+import json
+
+import pytest
+
+from api.pagination import apply_keyset, decode_cursor, encode_cursor
+from api.services import ServiceError, apply_expense_filters, history_page
+
+
+class FakeQuery:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self.calls.append((name, args))
+            return self
+        return record
+
+
+def _cursor(value) -> str:
+    raw = json.dumps(value).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+CRAFTED = [
+    _cursor(['x",id.gt.0)', "1),user_id.neq.0"]),
+    _cursor(["2024-05-01T10:00:00+00:00", "1),user_id.neq.0"]),
+    _cursor(['2024-05-01T10:00:00+00:00",id.gt.0),or=(id.gt.0', 1]),
+    _cursor(["2024-05-01T10:00:00+00:00,(a)", 1]),
+    _cursor(["2024-05-01T10:00:00+00:00", 1.5]),
+    _cursor(["2024-05-01T10:00:00+00:00", True]),
+    _cursor(["2024-05-01T10:00:00+00:00", None]),
+    _cursor(["not a timestamp", 1]),
+    _cursor(["2024-13-45T99:00:00", 1]),
+    _cursor({"created_at": "2024-05-01", "id": 1}),
+    "%%%not-base64",
+]
+
+
+@pytest.mark.parametrize("cursor", CRAFTED)
+def test_crafted_cursor_is_rejected(cursor):
+    assert decode_cursor(cursor) is None
+
+
+@pytest.mark.parametrize("cursor", CRAFTED)
+def test_history_page_answers_400_on_crafted_cursor(cursor):
+    with pytest.raises(ServiceError) as exc:
+        history_page(1, cursor, 20, {})
+    assert exc.value.status == 400
+
+
+def test_valid_cursor_builds_quoted_keyset_filter():
+    cursor = encode_cursor({"created_at": "2024-05-01T10:00:00.5Z", "id": 42})
+    after = decode_cursor(cursor)
+    assert after == ("2024-05-01T10:00:00.500000+00:00", 42)
+
+    query = FakeQuery()
+    apply_keyset(query, after)
+    assert query.calls[0] == (
+        "or_",
+        ('created_at.lt."2024-05-01T10:00:00.500000+00:00",'
+         'and(created_at.eq."2024-05-01T10:00:00.500000+00:00",id.lt.42)',),
+    )
+
+
+def test_expense_type_filter_keeps_rows_without_type():
+    query = FakeQuery()
+    apply_expense_filters(query, {"type": "expense"})
+    assert query.calls == [("or_", ("type.is.null,type.neq.income",))]